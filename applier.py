@@ -0,0 +1,100 @@
+
+from __future__ import annotations
+
+from io import TextIOWrapper
+from typing import Callable
+
+from matcher import environment_checker, environment_works, match_change, work_counter, work_limit_error
+from metrics import measure, run_metrics
+
+from output_formats import output_formats
+from parsing import parse_rule_file
+from replacer import replace_matches
+from rule_ast import rule_node
+
+
+def apply_rule(rule: rule_node, word: str, checker: environment_checker = None, work_limit: int = None) -> str:
+    """Applies a rule to a word. If given, checker decides on environments; it must have been made
+    for this rule, and is best shared across many words so it can learn a good order to check them in.
+    With a work_limit, raises work_limit_error naming the rule and word if matching takes more steps than that."""
+    counter = work_counter(work_limit) if work_limit else None
+    memoize = rule.memoize
+    new_word = word
+    try:
+        for change in rule.changes:
+            naive_matches = match_change(change, word, counter, memoize)
+            matches = []
+            for match in naive_matches:
+                # successfully match if none of the negative environments match, and
+                # there are no positive environments, or
+                # one of the positive environments matches 
+                if checker:
+                    if checker.allows(word, match, counter, memoize):
+                        matches.append(match)
+                elif all(environment_works(env, word, match, counter, memoize) for env in rule.negative_environments) \
+                            and (not rule.positive_environments \
+                            or any(environment_works(env, word, match, counter, memoize) for env in rule.positive_environments)):
+                    matches.append(match)
+            if matches: 
+                new_word = replace_matches(new_word, matches, change)
+    except work_limit_error as error:
+        # as with parse errors, add which rule and word it was to the message and reraise it
+        context = (f"Line {rule.linenum}:", f"Rule \"{rule.source}\":") if rule.source else ()
+        error.args = ("\n".join((*context, f"Word \"{word}\":", error.args[0])),)
+        raise
+    return new_word
+
+
+def apply_rules(rule_list: list[rule_node], word_list: list[str], start_rule: int = 0,
+                on_rule_done: Callable[[int, list[str]], None] = None, metrics: run_metrics = None,
+                work_limit: int = None) -> list[str]:
+    if metrics:
+        metrics.start_rules()
+    # iterate in this order, applying each rule to every word before moving on,
+    # to keep open possibilities for pausing or halting execution at certain "times"
+    # within a rule list
+    for rule_idx in range(start_rule, len(rule_list)):
+        rule = rule_list[rule_idx]
+        # only worth the bookkeeping when there's a choice of order
+        if len(rule.positive_environments) + len(rule.negative_environments) > 1:
+            checker = environment_checker(rule.negative_environments, rule.positive_environments)
+        else:
+            checker = None
+        for idx, word in enumerate(word_list):
+            word_list[idx] = apply_rule(rule, word, checker, work_limit)
+        if metrics:
+            metrics.rule_done(rule_idx + 1, len(word_list))
+        # the lexicon is consistent between rules, so this is where progress can be recorded
+        if on_rule_done:
+            on_rule_done(rule_idx + 1, word_list)
+    return word_list
+
+
+def load_lexicon(lex_file: TextIOWrapper):
+    return [word for word in [line.strip() for line in lex_file]]
+
+
+def change_sounds(lex_file: TextIOWrapper, rule_file: TextIOWrapper, metrics: run_metrics = None) -> list[str]:
+    with measure(metrics, "loading"):
+        lexicon = load_lexicon(lex_file)
+    rule_list = parse_rule_file(rule_file, metrics)
+    with measure(metrics, "applying"):
+        return apply_rules(rule_list, lexicon, metrics = metrics)
+
+
+def write_output(word_list: list[str], out_file: TextIOWrapper, original_words: list[str] = None,
+                 out_format: str = "plain", first_line: int = 0):
+    """Writes the changed lexicon in one of the formats in output_formats.
+    Every format but plain also needs the lexicon from before any changes."""
+    # if there are any words to record, write to the output
+    # otherwise don't mess with the output file to avoid
+    # erasing anything when not needed
+    if word_list:
+        if not out_file:
+            # no r+ this time since we already know we want to overwrite this one
+            with open("./changed_words", "w", encoding = "utf-8") as out_file:
+                output_formats[out_format](out_file, word_list, original_words, first_line)
+        else:
+            # clear anything already in an existing file passed in from the command line
+            out_file.truncate(0)
+            output_formats[out_format](out_file, word_list, original_words, first_line)
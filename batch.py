@@ -0,0 +1,194 @@
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+
+from applier import apply_rules, load_lexicon, write_output
+from parsing import parse_rule_file
+from rule_ast import rule_node
+
+
+_comment_chars = "#%"
+
+
+@dataclass
+class batch_job:
+    lex_path: Path
+    rules_path: Path
+    out_path: Path
+
+
+@dataclass
+class job_result:
+    job: batch_job
+    ok: bool = False
+    error: str = ""
+    word_count: int = 0
+    read_time: float = 0.0
+    parse_time: float = 0.0
+    apply_time: float = 0.0
+    write_time: float = 0.0
+    total_time: float = 0.0
+
+    def __str__(self):
+        status = "ok" if self.ok else "FAILED"
+        line = f"[{status}] {self.job.lex_path} + {self.job.rules_path} -> {self.job.out_path}"
+        if not self.ok:
+            return line + f"\n    {self.error}"
+        return line + (f"\n    {self.word_count} words; read {self.read_time:.3f}s, parse {self.parse_time:.3f}s,"
+                       f" apply {self.apply_time:.3f}s, write {self.write_time:.3f}s, total {self.total_time:.3f}s")
+
+
+def _default_out_path(lex_path: Path, rules_path: Path) -> Path:
+    return lex_path.with_name(f"{lex_path.name}.{rules_path.stem}.changed")
+
+
+def read_manifest(manifest_path: Path) -> list[batch_job]:
+    """Reads a manifest of jobs, one per line, of the form:
+    lex_path rules_path [out_path]
+
+    Relative paths are taken relative to the manifest's directory. Blank lines and lines
+    starting with a comment character are skipped, as in rule files."""
+    base_dir = manifest_path.parent
+    jobs: list[batch_job] = []
+
+    with open(manifest_path, "r", encoding = "utf-8") as manifest:
+        for linenum, line in enumerate(manifest, start = 1):
+            line = line.strip()
+            if not line or line[0] in _comment_chars:
+                continue
+
+            fields = line.split()
+            if len(fields) not in (2, 3):
+                raise ValueError(f"Line {linenum} of {manifest_path} is not of the form:\nlex_path rules_path [out_path]")
+
+            lex_path, rules_path = base_dir/fields[0], base_dir/fields[1]
+            if len(fields) == 3:
+                out_path = base_dir/fields[2]
+            else:
+                out_path = _default_out_path(lex_path, rules_path)
+            jobs.append(batch_job(lex_path, rules_path, out_path))
+
+    return jobs
+
+
+def _read_lexicon(path: Path) -> list[str]:
+    with open(path, "r", encoding = "utf-8") as lex_file:
+        return load_lexicon(lex_file)
+
+def _read_rules(path: Path) -> list[rule_node]:
+    with open(path, "r", encoding = "utf-8") as rule_file:
+        return parse_rule_file(rule_file)
+
+def _write_words(word_list: list[str], path: Path):
+    with open(path, "w", encoding = "utf-8") as out_file:
+        write_output(word_list, out_file)
+
+
+class batch_runner:
+    """Runs many (lexicon, rules) jobs in one process.
+
+    File reads, rule parsing and writes go through io_executor, while applying rules goes
+    through cpu_executor, so that I/O for some jobs overlaps with the work of others.
+    Each distinct rule file is only ever parsed once, however many jobs use it."""
+
+    def __init__(self, max_concurrent: int = 4, io_executor: Executor = None, cpu_executor: Executor = None):
+        self.max_concurrent = max_concurrent
+        self.io_executor = io_executor
+        self.cpu_executor = cpu_executor
+        # futures rather than finished rule lists, so that jobs arriving while a rule file
+        # is still being parsed wait on that parse instead of starting their own
+        self._rule_cache: dict[Path, asyncio.Future[list[rule_node]]] = {}
+
+    def _get_rules(self, path: Path) -> asyncio.Future[list[rule_node]]:
+        key = path.resolve()
+        if key not in self._rule_cache:
+            loop = asyncio.get_running_loop()
+            self._rule_cache[key] = loop.run_in_executor(self.io_executor, _read_rules, key)
+        return self._rule_cache[key]
+
+    async def run_job(self, job: batch_job, semaphore: asyncio.Semaphore) -> job_result:
+        result = job_result(job)
+        loop = asyncio.get_running_loop()
+
+        async with semaphore:
+            job_start = perf_counter()
+            try:
+                start = perf_counter()
+                # start both reads before waiting on either
+                rules_future = self._get_rules(job.rules_path)
+                word_list = await loop.run_in_executor(self.io_executor, _read_lexicon, job.lex_path)
+                result.read_time = perf_counter() - start
+
+                start = perf_counter()
+                # shield the shared parse so one job failing or being cancelled doesn't affect the others
+                rule_list = await asyncio.shield(rules_future)
+                result.parse_time = perf_counter() - start
+
+                start = perf_counter()
+                word_list = await loop.run_in_executor(self.cpu_executor, apply_rules, rule_list, word_list)
+                result.apply_time = perf_counter() - start
+
+                start = perf_counter()
+                await loop.run_in_executor(self.io_executor, _write_words, word_list, job.out_path)
+                result.write_time = perf_counter() - start
+
+                result.word_count = len(word_list)
+                result.ok = True
+
+            except Exception as error:
+                result.error = f"{type(error).__name__}: {error}"
+
+            result.total_time = perf_counter() - job_start
+
+        return result
+
+    async def run(self, jobs: list[batch_job]) -> list[job_result]:
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        return await asyncio.gather(*(self.run_job(job, semaphore) for job in jobs))
+
+
+def run_batch(jobs: list[batch_job], max_concurrent: int = 4, processes: int = 0) -> list[job_result]:
+    """Runs every job and returns their results, in the same order as the jobs.
+
+    If processes is nonzero, rules are applied in a pool of that many worker processes,
+    otherwise they are applied in threads alongside the I/O."""
+    with ThreadPoolExecutor(max_workers = max_concurrent) as io_executor:
+        if processes:
+            with ProcessPoolExecutor(max_workers = processes) as cpu_executor:
+                runner = batch_runner(max_concurrent, io_executor, cpu_executor)
+                return asyncio.run(runner.run(jobs))
+        else:
+            runner = batch_runner(max_concurrent, io_executor, io_executor)
+            return asyncio.run(runner.run(jobs))
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Run many sound change jobs listed in a manifest file.")
+
+    parser.add_argument("manifest", action = "store", type = Path)
+    parser.add_argument("-j", "--jobs", action = "store", type = int, default = 4, dest = "max_concurrent",
+        help = "maximum number of jobs in flight at once")
+    parser.add_argument("-p", "--processes", action = "store", type = int, default = 0,
+        help = "apply rules in this many worker processes instead of in threads")
+
+    args = parser.parse_args()
+
+    batch_start = perf_counter()
+
+    results = run_batch(read_manifest(args.manifest), args.max_concurrent, args.processes)
+    for result in results:
+        print(result)
+
+    failures = sum(not result.ok for result in results)
+    print(f"{len(results) - failures}/{len(results)} jobs succeeded in {perf_counter() - batch_start:.3f}s")
+
+    if failures:
+        raise SystemExit(1)
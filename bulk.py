@@ -0,0 +1,243 @@
+
+from __future__ import annotations
+
+from typing import Callable
+
+import regex as re
+
+from applier import apply_rule, apply_rules
+from matcher import _reverse_node
+from regex_util import lookahead, lookbehind, no_match, regex_concat, regex_group, regex_or
+from rule_ast import rule_node
+from transducer import alternative, alternative_replacement, compile_rule, expand, not_finite
+
+
+# the lexicon is kept as one string, words separated by this
+_separator = "\n"
+
+
+#########################################################################################################################
+# compiling rules to patterns
+
+def _alternative_pattern(alt: alternative) -> str:
+    "A pattern matching exactly where alt.matches would, including the class sounds that must not match."
+    pieces = []
+    done = 0
+    for offset, sounds in sorted(alt.exclusions, key = lambda exclusion: exclusion[0]):
+        pieces.append(re.escape(alt.string[done:offset]))
+        pieces.append(lookahead(regex_or(*map(re.escape, sounds)), positive = False))
+        done = offset
+    pieces.append(re.escape(alt.string[done:]))
+    return "".join(pieces)
+
+
+def _expression_pattern(alternatives: list[alternative], capture: bool = False) -> str:
+    """Alternatives are tried in order and the first that matches is taken, just as _first_match_table does.
+    With capture, each alternative is its own group, so which one matched is the match's lastindex."""
+    return regex_or(*(regex_group(_alternative_pattern(alt), silent = not capture) for alt in alternatives))
+
+
+def _lookbehind_pattern(alternatives: list[alternative]) -> str:
+    """A pattern for inside a lookbehind, matching the text just before a position where one of the alternatives
+    of a reversed expression matches the reversed text (as the pre-environment is checked by environment_works).
+    Excluded sounds become lookbehinds themselves, at the point the class sound they exclude ends."""
+    patterns = []
+    for alt in alternatives:
+        forward = alt.string[::-1]
+        pieces = []
+        done = 0
+        for offset, sounds in sorted(alt.exclusions, key = lambda exclusion: -exclusion[0]):
+            pos = len(forward) - offset
+            pieces.append(re.escape(forward[done:pos]))
+            pieces.append(lookbehind(regex_or(*(re.escape(sound[::-1]) for sound in sounds)), positive = False))
+            done = pos
+        pieces.append(re.escape(forward[done:]))
+        patterns.append(regex_group("".join(pieces), silent = True))
+    return regex_or(*patterns)
+
+
+def _environment_pattern(env) -> str:
+    """A zero-width pattern matching at the start of a single character match where env's pre- and post-environment
+    both match around it. An empty string matches everywhere."""
+    pre, post = expand(_reverse_node(env.pre_expression)), expand(env.post_expression)
+    pre_pattern = "" if any(not alt.string for alt in pre) else lookbehind(_lookbehind_pattern(pre))
+    post_pattern = "" if any(not alt.string for alt in post) \
+            else lookahead("." + regex_group(_expression_pattern(post), silent = True))
+    return regex_concat(pre_pattern, post_pattern)
+
+
+def _environments_pattern(rule: rule_node) -> str:
+    "A zero-width pattern matching at the start of a single character match where the rule's environments allow it."
+    pieces = []
+    for env in rule.negative_environments:
+        env_pattern = _environment_pattern(env)
+        if not env_pattern:
+            # a negative environment that always matches never works
+            return no_match
+        pieces.append(lookahead(env_pattern, positive = False))
+    if rule.positive_environments:
+        env_patterns = [_environment_pattern(env) for env in rule.positive_environments]
+        if all(env_patterns):
+            pieces.append(regex_group(regex_or(*env_patterns), silent = True))
+    return regex_concat(*pieces)
+
+
+class _bulk_environment:
+    """An environment checked against the whole lexicon at once. Like environment_works, the pre-environment
+    is reversed and checked against the reversed lexicon. No alternative can contain the separator,
+    so matches never reach into neighbouring words."""
+
+    def __init__(self, env):
+        pre, post = expand(_reverse_node(env.pre_expression)), expand(env.post_expression)
+        # an empty side always matches, so it needn't be checked at all
+        self.pre = re.compile(_expression_pattern(pre)) if any(alt.string for alt in pre) else None
+        self.post = re.compile(_expression_pattern(post)) if any(alt.string for alt in post) else None
+        self.is_positive = env.is_positive
+
+    def works(self, buffer: str, reversed_buffer: str, start: int, end: int) -> bool:
+        matched = (self.pre is None or self.pre.match(reversed_buffer, len(buffer) - start) is not None) \
+                and (self.post is None or self.post.match(buffer, end) is not None)
+        return matched == self.is_positive
+
+
+class bulk_rule:
+    """A rule applied to the whole lexicon in one pass of a single pattern.
+
+    match_change picks its (non-overlapping) matches without regard to environments, so in general matches
+    have to be found over the whole buffer first and only then checked against the environments; putting
+    the environments in the pattern would let it find matches overlapping rejected ones, which the interpreter
+    never would. Where every match is a single character there's nothing to overlap, and the environments
+    are part of the pattern, leaving nothing to check afterwards."""
+
+    def __init__(self, rule: rule_node, target: re.Pattern, replacements: list[str],
+                 positive_environments: list[_bulk_environment], negative_environments: list[_bulk_environment]):
+        self.rule = rule
+        self.target = target
+        self.replacements = replacements
+        self.positive_environments = positive_environments
+        self.negative_environments = negative_environments
+
+    def environments_work(self, buffer: str, reversed_buffer: str, start: int, end: int) -> bool:
+        return all(env.works(buffer, reversed_buffer, start, end) for env in self.negative_environments) \
+                and (not self.positive_environments
+                or any(env.works(buffer, reversed_buffer, start, end) for env in self.positive_environments))
+
+    def _replace(self, match: re.Match) -> str:
+        return self.replacements[match.lastindex - 1]
+
+    def __call__(self, buffer: str) -> str:
+        check_environments = self.positive_environments or self.negative_environments
+        if not check_environments:
+            if len(set(self.replacements)) == 1:
+                # the same replacement everywhere, so the pattern's sub can do everything itself
+                return self.target.sub(self.replacements[0].replace("\\", "\\\\"), buffer)
+            return self.target.sub(self._replace, buffer)
+
+        reversed_buffer = buffer[::-1]
+        pieces = []
+        done = 0
+        for match in self.target.finditer(buffer):
+            start, end = match.span()
+            if not self.environments_work(buffer, reversed_buffer, start, end):
+                continue
+            pieces.append(buffer[done:start])
+            pieces.append(self.replacements[match.lastindex - 1])
+            done = end
+        if not pieces:
+            return buffer
+        pieces.append(buffer[done:])
+        return "".join(pieces)
+
+
+def compile_bulk_rule(rule: rule_node) -> bulk_rule | None:
+    """Compiles a rule with a single change whose target and environments only ever match a finite set of strings
+    (as for the compiled engine). Returns None for any other rule."""
+    if len(rule.changes) != 1:
+        # every change of a rule matches against the word as it was before the rule, which one pattern can't do
+        return None
+    change = rule.changes[0]
+    if not change.target or not change.replacement:
+        return None
+
+    try:
+        alternatives = expand(change.target[0])
+        if any(not alt.string for alt in alternatives):
+            return None
+        replacements = [alternative_replacement(alt, change) for alt in alternatives]
+        target = _expression_pattern(alternatives, capture = True)
+
+        if all(len(alt.string) == 1 for alt in alternatives):
+            return bulk_rule(rule, re.compile(regex_concat(_environments_pattern(rule), regex_group(target, silent = True))),
+                             replacements, [], [])
+        return bulk_rule(rule, re.compile(target), replacements,
+                         [_bulk_environment(env) for env in rule.positive_environments],
+                         [_bulk_environment(env) for env in rule.negative_environments])
+    except not_finite:
+        return None
+    except Exception:
+        # the replacer fails on this rule; leave it to fail the same way in the interpreter
+        return None
+
+
+#########################################################################################################################
+# everything else, a line at a time
+
+class line_rule:
+    """A rule that can't be applied in bulk, applied to each affected word of the lexicon.
+
+    If every target of the rule only ever matches a finite set of strings, only the words containing
+    a character one of those could start with are affected. Otherwise every word is."""
+
+    def __init__(self, rule: rule_node):
+        self.rule = rule
+        compiled = compile_rule(rule)
+        self.apply: Callable[[str], str] = compiled or (lambda word: apply_rule(rule, word))
+
+        self.first_chars = None
+        try:
+            alternatives = [alt for change in rule.changes if change.target for alt in expand(change.target[0])]
+            if all(alt.string for alt in alternatives):
+                chars = sorted({alt.string[0] for alt in alternatives})
+                self.first_chars = re.compile(regex_or(*map(re.escape, chars)) if chars else no_match)
+        except not_finite:
+            pass
+
+    def __call__(self, buffer: str) -> str:
+        if self.first_chars is None:
+            return _separator.join(apply_rules([self.rule], buffer.split(_separator)))
+
+        pieces = []
+        done = 0
+        search = self.first_chars.search
+        while (match := search(buffer, done)) is not None:
+            line_start = buffer.rfind(_separator, 0, match.start()) + 1
+            line_end = buffer.find(_separator, match.start())
+            if line_end == -1:
+                line_end = len(buffer)
+            pieces.append(buffer[done:line_start])
+            pieces.append(self.apply(buffer[line_start:line_end]))
+            done = line_end
+        pieces.append(buffer[done:])
+        return "".join(pieces)
+
+
+#########################################################################################################################
+# applying
+
+def compile_bulk(rule_list: list[rule_node]) -> list[bulk_rule | line_rule]:
+    return [compile_bulk_rule(rule) or line_rule(rule) for rule in rule_list]
+
+
+def apply_bulk(stages: list[bulk_rule | line_rule], word_list: list[str]) -> list[str]:
+    """Applies rules to a lexicon kept as a single string, with the same results as apply_rules.
+    Words can't contain the separator, as they're lines of the lexicon file."""
+    if not word_list:
+        return word_list
+    buffer = _separator.join(word_list)
+    for stage in stages:
+        buffer = stage(buffer)
+    return buffer.split(_separator)
+
+
+def apply_rules_bulk(rule_list: list[rule_node], word_list: list[str]) -> list[str]:
+    return apply_bulk(compile_bulk(rule_list), word_list)
@@ -0,0 +1,109 @@
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from time import monotonic
+from typing import TextIO
+
+
+_checkpoint_name = "checkpoint"
+_checkpoint_version = 1
+
+
+def run_digest(rules_text: str, word_list: list[str]) -> str:
+    "Fingerprints a run's inputs, so that a checkpoint is never resumed against different rules or words."
+    digest = hashlib.sha256(rules_text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update("\n".join(word_list).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class checkpointer:
+    """Saves and restores the progress of a run in a directory.
+
+    A checkpoint is a single file: a json header line recording how many rules have been applied,
+    followed by the partially changed lexicon, one word per line. Checkpoints are written to a temporary
+    file and moved into place, so a run killed mid-write leaves the previous checkpoint intact."""
+
+    def __init__(self, directory: str | os.PathLike, digest: str):
+        self.directory = Path(directory)
+        self.digest = digest
+        self.path = self.directory/_checkpoint_name
+
+    def save(self, rules_done: int, word_list: list[str]):
+        self.directory.mkdir(parents = True, exist_ok = True)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        header = {"version": _checkpoint_version, "digest": self.digest, "rules_done": rules_done, "words": len(word_list)}
+        with open(temp_path, "w", encoding = "utf-8") as temp_file:
+            temp_file.write(json.dumps(header) + "\n")
+            temp_file.write("\n".join(word_list))
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def load(self) -> tuple[int, list[str]] | None:
+        """Returns the number of rules done and the lexicon at that point, or None if there is
+        no usable checkpoint for this run."""
+        try:
+            with open(self.path, "r", encoding = "utf-8") as checkpoint_file:
+                header = json.loads(checkpoint_file.readline())
+                if header.get("version") != _checkpoint_version or header.get("digest") != self.digest:
+                    return None
+                word_list = checkpoint_file.read().split("\n")
+        except (OSError, ValueError):
+            return None
+
+        # "".split gives [""], so an empty lexicon needs special handling
+        if header["words"] == 0:
+            word_list = []
+        if len(word_list) != header["words"]:
+            return None
+        return header["rules_done"], word_list
+
+    def clear(self):
+        self.path.unlink(missing_ok = True)
+
+
+class progress_monitor:
+    """Callback for apply_rules that reports progress and an ETA, and saves checkpoints periodically.
+
+    Either part may be left off by passing None for its checkpointer or output stream."""
+
+    def __init__(self, rule_count: int, word_count: int, start_rule: int = 0, checkpoints: checkpointer = None,
+                 interval: float = 60.0, out: TextIO | None = sys.stderr):
+        self.rule_count = rule_count
+        self.word_count = word_count
+        self.start_rule = start_rule
+        self.checkpoints = checkpoints
+        self.interval = interval
+        self.out = out
+
+        self.start_time = monotonic()
+        self.last_save = self.start_time
+
+    def __call__(self, rules_done: int, word_list: list[str]):
+        now = monotonic()
+
+        if self.checkpoints and now - self.last_save >= self.interval:
+            self.checkpoints.save(rules_done, word_list)
+            self.last_save = now
+
+        if self.out:
+            self.out.write(self.report(rules_done, now) + "\n")
+            self.out.flush()
+
+    def report(self, rules_done: int, now: float) -> str:
+        elapsed = now - self.start_time
+        # rules are applied to every word in turn, so rule applications are a fair unit of work
+        done_this_run = (rules_done - self.start_rule) * self.word_count
+        remaining = (self.rule_count - rules_done) * self.word_count
+        rate = done_this_run / elapsed if elapsed > 0 else 0.0
+
+        line = f"rule {rules_done}/{self.rule_count}, {done_this_run} rule applications in {elapsed:.1f}s"
+        if rate:
+            line += f" ({rate:.0f} rule applications/s), ETA {remaining / rate:.1f}s"
+        return line
@@ -0,0 +1,271 @@
+
+from __future__ import annotations
+
+import argparse
+import hmac
+import json
+import os
+import socket
+import struct
+import threading
+import traceback
+from collections import deque
+from io import StringIO
+from time import monotonic, sleep
+from typing import Callable, Optional, Sequence
+
+from applier import apply_rules, write_output
+from lexicon_index import mapped_lexicon
+from parsing import parse_rule_file
+
+
+#########################################################################################################################
+# messages
+# every message is a json object, sent as its utf-8 length (4 bytes, big-endian) followed by the utf-8 itself
+
+_length = struct.Struct(">I")
+
+# anything longer is refused rather than read, so that a peer can't make the other side allocate up to 4GiB;
+# a shard of a few thousand words is well under a megabyte
+max_message_size = 64 << 20
+# a hello is read before the peer has shown it knows the token, so it gets far less
+max_hello_size = 4 << 10
+
+
+def send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message, ensure_ascii = False).encode("utf-8")
+    sock.sendall(_length.pack(len(data)) + data)
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive_message(sock: socket.socket, max_size: int = max_message_size) -> dict:
+    (size,) = _length.unpack(_receive_exactly(sock, _length.size))
+    if size > max_size:
+        raise ConnectionError(f"Message of {size} bytes is over the limit of {max_size}")
+    return json.loads(_receive_exactly(sock, size).decode("utf-8"))
+
+
+#########################################################################################################################
+# coordinator
+
+class coordinator:
+    """Hands out shards of a lexicon to workers connecting over TCP, and puts their results back together in order.
+
+    Shards are line ranges of the lexicon, which is only read a shard at a time as they're handed out,
+    so a mapped_lexicon never needs to be decoded into a list of every word.
+    Each worker gets the rule file once, when it connects, and then shards one at a time. A shard whose worker
+    disconnects, sends back something that isn't a result, or takes longer than shard_timeout seconds (if given)
+    is dropped along with its worker, and goes back to be handed out again.
+    A rule failing on a worker stops the whole run, as it would fail the same way anywhere else.
+
+    If token is given, workers have to send it in their hello, and anyone connecting without it
+    is hung up on before being sent anything. Without one, any host that can reach the coordinator
+    can act as a worker, and so put whatever it likes in the output."""
+
+    def __init__(self, rules_text: str, lexicon: Sequence[str], shard_size: int = 1000, host: str = "127.0.0.1",
+                 port: int = 0, engine: str = "interpreter", shard_timeout: float = None, token: str = None):
+        self.rules_text = rules_text
+        self.token = token
+        self.lexicon = lexicon
+        self.shards = [(start, min(start + shard_size, len(lexicon))) for start in range(0, len(lexicon), shard_size)]
+        self.engine = engine
+        self.shard_timeout = shard_timeout
+
+        self.pending = deque(range(len(self.shards)))
+        self.results: dict[int, list[str]] = {}
+        self.error: Optional[str] = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.server = socket.create_server((host, port))
+        self.address: tuple[str, int] = self.server.getsockname()[:2]
+
+    @property
+    def finished(self) -> bool:
+        return self.closed or self.error is not None or len(self.results) == len(self.shards)
+
+    def _serve(self, sock: socket.socket):
+        shard_id = None
+        try:
+            with sock:
+                hello = receive_message(sock, max_hello_size)
+                if self.token is not None and not hmac.compare_digest(
+                        str(hello.get("token")).encode("utf-8"), self.token.encode("utf-8")):
+                    return
+                send_message(sock, {"type": "rules", "text": self.rules_text, "engine": self.engine})
+                reply = receive_message(sock)
+                if reply["type"] == "error":
+                    with self.condition:
+                        self.error = f"Parsing the rules failed:\n{reply['error']}"
+                        self.condition.notify_all()
+                    return
+                while True:
+                    with self.condition:
+                        while not self.pending and not self.finished:
+                            self.condition.wait()
+                        if self.finished:
+                            break
+                        shard_id = self.pending.popleft()
+
+                    sock.settimeout(self.shard_timeout)
+                    start, stop = self.shards[shard_id]
+                    send_message(sock, {"type": "shard", "id": shard_id, "words": self.lexicon[start:stop]})
+                    reply = receive_message(sock)
+                    sock.settimeout(None)
+
+                    with self.condition:
+                        if reply["type"] == "error":
+                            self.error = f"Shard {shard_id} failed:\n{reply['error']}"
+                        else:
+                            # a worker that timed out has been disconnected, so every shard comes back only once
+                            self.results[shard_id] = reply["words"]
+                        shard_id = None
+                        self.condition.notify_all()
+
+                send_message(sock, {"type": "done"})
+
+        except Exception:
+            # the worker died, hung or sent nonsense: put its shard back for someone else
+            with self.condition:
+                if shard_id is not None:
+                    self.pending.appendleft(shard_id)
+                self.condition.notify_all()
+
+    def _accept(self):
+        self.server.settimeout(0.1)
+        while not self.finished:
+            try:
+                sock, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            threading.Thread(target = self._serve, args = (sock,), daemon = True).start()
+
+    def run(self, timeout: float = None) -> list[str]:
+        "Waits for workers to change every shard, and returns the changed lexicon."
+        acceptor = threading.Thread(target = self._accept, daemon = True)
+        acceptor.start()
+        try:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.finished, timeout):
+                    raise TimeoutError(f"{len(self.shards) - len(self.results)} shards were not finished in time")
+                if self.error:
+                    raise RuntimeError(self.error)
+                return [word for shard_id in range(len(self.shards)) for word in self.results[shard_id]]
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            acceptor.join()
+            self.server.close()
+
+
+#########################################################################################################################
+# worker
+
+def _rule_function(rules_text: str, engine: str) -> Callable[[list[str]], list[str]]:
+    rule_list = parse_rule_file(StringIO(rules_text))
+    if engine == "compiled":
+        from transducer import apply_compiled, compile_rules
+        stages = compile_rules(rule_list)
+        return lambda words: apply_compiled(stages, words)
+    return lambda words: apply_rules(rule_list, words)
+
+
+def run_worker(host: str, port: int, connect_timeout: float = 10.0, token: str = None) -> int:
+    """Connects to a coordinator and changes shards until told there are none left.
+    token has to be the coordinator's, if it has one.
+    Keeps trying to connect for up to connect_timeout seconds, in case the coordinator isn't up yet.
+    Returns how many shards it changed, including any the coordinator gave up waiting for and disconnected it over."""
+    deadline = monotonic() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except ConnectionRefusedError:
+            if monotonic() > deadline:
+                raise
+            sleep(0.1)
+
+    shards_done = 0
+    with sock:
+        try:
+            send_message(sock, {"type": "hello", "token": token})
+            setup = receive_message(sock)
+        except OSError:
+            # the coordinator finished before getting to this worker, or didn't accept its token
+            return 0
+        try:
+            apply = _rule_function(setup["text"], setup["engine"])
+        except Exception:
+            send_message(sock, {"type": "error", "error": traceback.format_exc()})
+            raise
+        send_message(sock, {"type": "ready"})
+
+        try:
+            while (message := receive_message(sock))["type"] == "shard":
+                try:
+                    reply = {"type": "result", "id": message["id"], "words": apply(message["words"])}
+                except Exception:
+                    reply = {"type": "error", "id": message["id"], "error": traceback.format_exc()}
+                shards_done += 1
+                send_message(sock, reply)
+        except OSError:
+            # the coordinator timed this worker out, or finished and closed without saying it was done
+            pass
+    return shards_done
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Change a lexicon across several machines.")
+    subparsers = parser.add_subparsers(dest = "mode", required = True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help = "hand out the lexicon and collect the results")
+    coordinator_parser.add_argument("lex_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    coordinator_parser.add_argument("rules_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    # a, as in sound_changer, so an existing file isn't wiped if the run never finishes
+    coordinator_parser.add_argument("-o", "--out", action = "store", type = argparse.FileType("a", encoding = "utf-8"),
+        dest = "out_file", default = None)
+    coordinator_parser.add_argument("--host", action = "store", default = "127.0.0.1",
+        help = "address to listen on; workers on other machines need something like 0.0.0.0, along with --token")
+    coordinator_parser.add_argument("--port", action = "store", type = int, default = 5871)
+    coordinator_parser.add_argument("--shard-size", action = "store", type = int, default = 1000)
+    coordinator_parser.add_argument("--shard-timeout", action = "store", type = float, default = None,
+        help = "seconds after which a worker's shard is given to another worker")
+    coordinator_parser.add_argument("--engine", action = "store", choices = ("interpreter", "compiled"), default = "interpreter")
+    coordinator_parser.add_argument("--index", action = "store_true",
+        help = "save the lexicon's line index next to it, for the next run to reuse")
+
+    worker_parser = subparsers.add_parser("worker", help = "change shards for a coordinator")
+    worker_parser.add_argument("host", action = "store")
+    worker_parser.add_argument("--port", action = "store", type = int, default = 5871)
+
+    for subparser in (coordinator_parser, worker_parser):
+        subparser.add_argument("--token", action = "store", default = os.environ.get("SOUND_CHANGER_TOKEN"),
+            help = "shared secret workers need to take part (default: $SOUND_CHANGER_TOKEN)")
+
+    args = parser.parse_args()
+
+    if args.mode == "coordinator":
+        with mapped_lexicon(args.lex_file.name, persist_index = args.index) as lexicon:
+            coord = coordinator(args.rules_file.read(), lexicon, args.shard_size, args.host, args.port,
+                                args.engine, args.shard_timeout, args.token)
+            print(f"Waiting for workers on {coord.address[0]}:{coord.address[1]}")
+            word_list = coord.run()
+        write_output(word_list, args.out_file)
+    else:
+        print(f"Changed {run_worker(args.host, args.port, token = args.token)} shards")
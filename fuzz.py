@@ -0,0 +1,369 @@
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import random
+from dataclasses import dataclass, field, replace
+from io import StringIO
+from time import perf_counter
+from typing import Callable, Optional
+
+from applier import apply_rules
+from parsing import parse_rule_file
+from rule_ast import rule_node
+from rule_ast_nodes import *
+
+
+# an engine takes a parsed rule list and a lexicon, and returns the changed lexicon
+# engines may change the list they are given, so each one gets its own copy
+engine = Callable[[list[rule_node], list[str]], list[str]]
+
+
+def reference_engine(rule_list: list[rule_node], word_list: list[str]) -> list[str]:
+    return apply_rules(rule_list, word_list)
+
+
+def known_engines() -> dict[str, engine]:
+    "Every alternative engine in the tree, by name."
+    # imported here so that the harness doesn't depend on every engine just to import
+    from bulk import apply_rules_bulk
+    from shared_lexicon import apply_rules_shared
+    from transducer import apply_rules_compiled
+
+    return {
+        "compiled": apply_rules_compiled,
+        "bulk": apply_rules_bulk,
+        "shared": apply_rules_shared,
+    }
+
+
+def load_engine(spec: str) -> engine:
+    "Loads an engine from either the name of a known engine or a 'module:function' string."
+    engines = known_engines()
+    if spec in engines:
+        return engines[spec]
+    module_name, sep, function_name = spec.partition(":")
+    if not sep:
+        raise ValueError(f"Unknown engine '{spec}'; expected one of {sorted(engines)} or module:function")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+#########################################################################################################################
+# generating cases
+
+@dataclass
+class fuzz_config:
+    "Knobs for the random case generator."
+    # single-character and multi-character sounds; multigraphs exercise the tokenizer and class matching
+    sounds: tuple[str, ...] = ("a", "e", "i", "o", "u", "p", "t", "k", "s", "n", "ts", "ph")
+    # characters words may contain that no rule or class knows about
+    stray_chars: str = "xz"
+    class_names: str = "ABCDEFG"
+    max_classes: int = 4
+    max_class_size: int = 4
+    max_rules: int = 4
+    max_words: int = 6
+    max_word_sounds: int = 7
+    max_target_elements: int = 3
+    max_environments: int = 2
+    # nesting depth of optionals and {} lists
+    max_depth: int = 2
+    # how often a rule gets a second arrow, e.g. a > b > c
+    chain_chance: float = 0.1
+
+
+@dataclass
+class fuzz_case:
+    classes: dict[str, list[str]] = field(default_factory = dict)
+    rules: list[str] = field(default_factory = list)
+    words: list[str] = field(default_factory = list)
+
+    def rule_file_text(self) -> str:
+        lines = ["classes:"]
+        lines.extend(f"{name}={','.join(sounds)}" for name, sounds in self.classes.items())
+        lines.append("rules:")
+        lines.extend(self.rules)
+        return "\n".join(lines) + "\n"
+
+    def __str__(self):
+        return self.rule_file_text() + "words:\n" + "\n".join(repr(word) for word in self.words)
+
+
+class _case_generator:
+    # NOTE: numbered classes (P1) and word borders (#) aren't generated, as the parser can't yet
+    # collect them into expressions and the matcher has no implementation for them
+
+    def __init__(self, rng: random.Random, config: fuzz_config):
+        self.rng = rng
+        self.config = config
+        self.classes: dict[str, list[str]] = {}
+
+    def generate(self) -> fuzz_case:
+        rng = self.rng
+        config = self.config
+
+        class_count = rng.randint(0, config.max_classes)
+        for name in rng.sample(config.class_names, class_count):
+            size = rng.randint(1, config.max_class_size)
+            self.classes[name] = rng.sample(config.sounds, size)
+
+        rules = [self.rule() for _ in range(rng.randint(1, config.max_rules))]
+        words = [self.word() for _ in range(rng.randint(1, config.max_words))]
+        return fuzz_case(self.classes, rules, words)
+
+    def word(self) -> str:
+        pieces = self.rng.choices(self.config.sounds + tuple(self.config.stray_chars),
+                                  k = self.rng.randint(0, self.config.max_word_sounds))
+        return "".join(pieces)
+
+    def simple_element(self) -> str:
+        if self.classes and self.rng.random() < 0.4:
+            return self.rng.choice(list(self.classes))
+        return self.rng.choice(self.config.sounds)
+
+    def element(self, depth: int, required: bool) -> str:
+        "Makes an element of an expression; required elements always consume at least one sound."
+        roll = self.rng.random()
+        if depth < self.config.max_depth and roll < 0.15 and not required:
+            return "(" + self.expression(depth + 1, 1, 2, required = False) + ")"
+        elif depth < self.config.max_depth and roll < 0.3:
+            alternatives = [self.expression(depth + 1, 1, 2, required = True) for _ in range(self.rng.randint(2, 3))]
+            return "{" + ",".join(alternatives) + "}"
+        return self.simple_element()
+
+    def expression(self, depth: int, min_elements: int, max_elements: int, required: bool) -> str:
+        count = self.rng.randint(min_elements, max_elements)
+        # one element is enough to keep the whole expression from matching the empty string
+        required_idx = self.rng.randrange(count) if required and count else -1
+        return "".join(self.element(depth, idx == required_idx) for idx in range(count))
+
+    def replacement(self, target: str) -> str:
+        # a class can only be replaced by a class when it is the whole target, and the replacing
+        # class has to have a sound for every sound in the target class
+        if target in self.classes and self.rng.random() < 0.5:
+            candidates = [name for name, sounds in self.classes.items() if len(sounds) >= len(self.classes[target])]
+            return self.rng.choice(candidates)
+        roll = self.rng.random()
+        if roll < 0.2:
+            return "0"
+        sounds = self.rng.choices(self.config.sounds, k = self.rng.randint(1, 2))
+        return "".join(sounds)
+
+    def environment(self) -> str:
+        slash = self.rng.choice(("/", "/!"))
+        pre = self.expression(1, 0, 2, required = False)
+        post = self.expression(1, 0, 2, required = False)
+        return f"{slash} {pre}_{post}"
+
+    def rule(self) -> str:
+        target = self.expression(0, 1, self.config.max_target_elements, required = True)
+        changes = [target, self.replacement(target)]
+        if self.rng.random() < self.config.chain_chance:
+            changes.append(self.replacement(changes[-1]))
+        environments = [self.environment() for _ in range(self.rng.randint(0, self.config.max_environments))]
+        return " ".join([" > ".join(changes)] + environments)
+
+
+def random_case(rng: random.Random, config: fuzz_config = None) -> fuzz_case:
+    return _case_generator(rng, config or fuzz_config()).generate()
+
+
+#########################################################################################################################
+# running and comparing
+
+def _can_match_empty(node: ast_node) -> bool:
+    match node:
+        case sound_node(sound = s):
+            return not s
+        case expression_node(elements = elms):
+            return all(_can_match_empty(e) for e in elms)
+        case sound_list_node(expressions = exprs):
+            return any(_can_match_empty(e) for e in exprs)
+        case optional_node():
+            return True
+        case sound_class_node():
+            return False
+        case _:
+            # anything the matcher doesn't implement matches the empty string
+            return True
+
+def _is_runnable(rule_list: list[rule_node]) -> bool:
+    # a target that matches the empty string never moves match_change along, so it would hang every engine
+    # and changes missing either side are malformed rules that the parser lets through
+    return all(change.target and change.replacement and not _can_match_empty(change.target[0])
+               for rule in rule_list for change in rule.changes)
+
+
+def _parse_case(case: fuzz_case) -> Optional[list[rule_node]]:
+    try:
+        rule_list = parse_rule_file(StringIO(case.rule_file_text()))
+    except Exception:
+        return None
+    return rule_list if _is_runnable(rule_list) else None
+
+
+def _run_engine(run: engine, rule_list: list[rule_node], words: list[str]) -> tuple[object, float]:
+    "Returns an engine's result (or the type of the error it raised) and how long it took."
+    start = perf_counter()
+    try:
+        result = run(rule_list, list(words))
+    except Exception as error:
+        result = type(error)
+    return result, perf_counter() - start
+
+
+@dataclass
+class case_result:
+    case: fuzz_case
+    reference_result: object
+    alternative_result: object
+    reference_time: float
+    alternative_time: float
+
+    @property
+    def matches(self) -> bool:
+        return self.reference_result == self.alternative_result
+
+
+def run_case(case: fuzz_case, alternative: engine, reference: engine = reference_engine) -> Optional[case_result]:
+    "Runs a case through both engines, or returns None if the case isn't a valid rule file."
+    rule_list = _parse_case(case)
+    if rule_list is None:
+        return None
+    reference_result, reference_time = _run_engine(reference, rule_list, case.words)
+    alternative_result, alternative_time = _run_engine(alternative, rule_list, case.words)
+    return case_result(case, reference_result, alternative_result, reference_time, alternative_time)
+
+
+def _raised(result: object) -> bool:
+    return isinstance(result, type) and issubclass(result, Exception)
+
+def _fails(case: fuzz_case, alternative: engine, reference: engine, reference_raised: bool) -> bool:
+    result = run_case(case, alternative, reference)
+    # without holding the reference to the same kind of outcome, shrinking tends to wander off into
+    # malformed rules that the engines merely fail on differently
+    return result is not None and not result.matches and _raised(result.reference_result) == reference_raised
+
+
+def _shrink_candidates(case: fuzz_case):
+    "Yields smaller versions of a case, roughly biggest reductions first."
+    for idx in range(len(case.rules)):
+        yield replace(case, rules = case.rules[:idx] + case.rules[idx + 1:])
+    for idx in range(len(case.words)):
+        yield replace(case, words = case.words[:idx] + case.words[idx + 1:])
+    for name in case.classes:
+        yield replace(case, classes = {n: s for n, s in case.classes.items() if n != name})
+
+    for idx, rule in enumerate(case.rules):
+        # try dropping chunks of the rule text, which takes out environments, elements and so on
+        for length in (4, 3, 2, 1):
+            for start in range(len(rule) - length + 1):
+                smaller = rule[:start] + rule[start + length:]
+                yield replace(case, rules = case.rules[:idx] + [smaller] + case.rules[idx + 1:])
+
+    for idx, word in enumerate(case.words):
+        for start in range(len(word)):
+            smaller = word[:start] + word[start + 1:]
+            yield replace(case, words = case.words[:idx] + [smaller] + case.words[idx + 1:])
+
+    for name, sounds in case.classes.items():
+        for idx in range(len(sounds)):
+            if len(sounds) > 1:
+                smaller = dict(case.classes)
+                smaller[name] = sounds[:idx] + sounds[idx + 1:]
+                yield replace(case, classes = smaller)
+
+
+def shrink_case(case: fuzz_case, alternative: engine, reference: engine = reference_engine, max_steps: int = 1000) -> fuzz_case:
+    """Greedily makes a failing case smaller while the engines still disagree on it.
+    Returns the smallest failing case found."""
+    reference_raised = _raised(run_case(case, alternative, reference).reference_result)
+    for _ in range(max_steps):
+        for candidate in _shrink_candidates(case):
+            if _fails(candidate, alternative, reference, reference_raised):
+                case = candidate
+                break
+        else:
+            # nothing smaller fails
+            break
+    return case
+
+
+@dataclass
+class fuzz_report:
+    cases_run: int = 0
+    # generated cases that don't parse or would hang every engine
+    cases_skipped: int = 0
+    reference_time: float = 0.0
+    alternative_time: float = 0.0
+    failures: list[case_result] = field(default_factory = list)
+
+    def __str__(self):
+        lines = [f"{self.cases_run} cases run, {self.cases_skipped} skipped, {len(self.failures)} mismatches"]
+        if self.cases_run:
+            lines.append(f"reference: {self.reference_time:.3f}s total, {self.reference_time / self.cases_run * 1e6:.0f}us per case")
+            lines.append(f"alternative: {self.alternative_time:.3f}s total, {self.alternative_time / self.cases_run * 1e6:.0f}us per case")
+        for failure in self.failures:
+            lines.append("")
+            lines.append(str(failure.case))
+            lines.append(f"reference:   {failure.reference_result}")
+            lines.append(f"alternative: {failure.alternative_result}")
+        return "\n".join(lines)
+
+
+def fuzz(alternative: engine, cases: int = 1000, seed: int = None, config: fuzz_config = None,
+         reference: engine = reference_engine, max_failures: int = 1, shrink: bool = True) -> fuzz_report:
+    """Compares an alternative engine against the reference interpreter on random cases.
+    Stops after max_failures mismatches, shrinking each one to a minimal case if asked to."""
+    rng = random.Random(seed)
+    report = fuzz_report()
+
+    for _ in range(cases):
+        result = run_case(random_case(rng, config), alternative, reference)
+        if result is None:
+            report.cases_skipped += 1
+            continue
+
+        report.cases_run += 1
+        report.reference_time += result.reference_time
+        report.alternative_time += result.alternative_time
+
+        if not result.matches:
+            if shrink:
+                result = run_case(shrink_case(result.case, alternative, reference), alternative, reference)
+            report.failures.append(result)
+            if len(report.failures) >= max_failures:
+                break
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Check that an alternative engine gives the same results "
+        "as the reference interpreter on random rules and words.")
+
+    parser.add_argument("engines", action = "store", nargs = "*",
+        help = "names of known engines or module:function strings; defaults to every known engine")
+    parser.add_argument("-n", "--cases", action = "store", type = int, default = 1000)
+    parser.add_argument("-s", "--seed", action = "store", type = int, default = None)
+    parser.add_argument("--max-failures", action = "store", type = int, default = 1)
+    parser.add_argument("--no-shrink", action = "store_false", dest = "shrink")
+
+    args = parser.parse_args()
+
+    engine_specs = args.engines or sorted(known_engines())
+    if not engine_specs:
+        parser.error("no alternative engines to compare against")
+
+    failed = False
+    for spec in engine_specs:
+        report = fuzz(load_engine(spec), args.cases, args.seed, max_failures = args.max_failures, shrink = args.shrink)
+        print(f"== {spec}")
+        print(report)
+        failed = failed or bool(report.failures)
+
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,128 @@
+
+from __future__ import annotations
+
+import mmap
+import os
+import re
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterator
+
+
+# index file layout: magic, then lexicon size and mtime (to detect a stale index), then line count,
+# followed by the raw offsets array
+_index_magic = b"SCLXIDX2"
+_index_header = struct.Struct("<8sQQQ")
+
+# the line endings text mode (and so load_lexicon) splits on
+_line_end = re.compile(rb"\r\n?|\n")
+
+
+class mapped_lexicon:
+    """A read-only lexicon backed by a memory-mapped file.
+
+    Only an array of line start offsets is built up front; words are decoded as they are asked for.
+
+    Words read through this class are identical to those produced by load_lexicon, i.e. stripped lines,
+    with lines ending in any of \n, \r\n or a lone \r."""
+
+    def __init__(self, path: str | os.PathLike, index_path: str | os.PathLike = None, persist_index: bool = False):
+        self.path = Path(path)
+        self.index_path = Path(index_path) if index_path else self.path.with_name(self.path.name + ".idx")
+
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._size = stat.st_size
+        self._mtime = stat.st_mtime_ns
+
+        # mmap can't map empty files, so an empty lexicon just gets an empty buffer
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self._map = b""
+
+        self.offsets = self._load_index()
+        if self.offsets is None:
+            self.offsets = self._build_index()
+            if persist_index:
+                self._save_index()
+
+    def _build_index(self) -> array:
+        offsets = array("Q", [0])
+        offsets.extend(match.end() for match in _line_end.finditer(self._map))
+        # the last line may not end with a newline
+        if offsets[-1] < self._size:
+            offsets.append(self._size)
+        return offsets
+
+    def _load_index(self) -> array | None:
+        try:
+            with open(self.index_path, "rb") as index_file:
+                magic, size, mtime, count = _index_header.unpack(index_file.read(_index_header.size))
+                if magic != _index_magic or size != self._size or mtime != self._mtime:
+                    return None
+                offsets = array("Q")
+                offsets.fromfile(index_file, count)
+                return offsets
+        except (OSError, EOFError, struct.error):
+            # missing, unreadable or truncated indices are simply rebuilt
+            return None
+
+    def _save_index(self):
+        # write to a temporary file and move it into place so a half-written index is never picked up
+        temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(temp_path, "wb") as index_file:
+            index_file.write(_index_header.pack(_index_magic, self._size, self._mtime, len(self.offsets)))
+            self.offsets.tofile(index_file)
+        os.replace(temp_path, self.index_path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _line_span(self, idx: int) -> tuple[int, int]:
+        return self.offsets[idx], self.offsets[idx + 1]
+
+    def __getitem__(self, idx: int | slice) -> str | list[str]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("lexicon index out of range")
+        start, end = self._line_span(idx)
+        return str(self._map[start:end], "utf-8").strip()
+
+    def __iter__(self) -> Iterator[str]:
+        return self.words()
+
+    def words(self, start: int = 0, stop: int = None) -> Iterator[str]:
+        "Lazily decodes the words on lines [start, stop)."
+        stop = len(self) if stop is None else min(stop, len(self))
+        data = self._map
+        offsets = self.offsets
+        for idx in range(start, stop):
+            yield str(data[offsets[idx]:offsets[idx + 1]], "utf-8").strip()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> mapped_lexicon:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_line_range(range_str: str) -> tuple[int, int | None]:
+    """Parses a 'start:stop' string, where either end may be left off, into a pair of line numbers.
+    Unlike slices, neither end may be negative, as output line numbers are counted from start."""
+    start, sep, stop = range_str.partition(":")
+    if not sep:
+        raise ValueError(f"Line range '{range_str}' is not of the form start:stop")
+    start, stop = int(start) if start else 0, int(stop) if stop else None
+    if start < 0 or (stop is not None and stop < 0):
+        raise ValueError(f"Line range '{range_str}' has a negative end")
+    return start, stop
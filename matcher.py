@@ -1,7 +1,9 @@
 
 
-from typing import Iterable, Optional
-from dataclasses import dataclass, field
+from itertools import chain
+from math import prod
+from typing import Iterable, NamedTuple, Optional, Union
+from time import perf_counter_ns
 from warnings import warn
 
 from rule_ast_nodes import * 
@@ -12,87 +14,222 @@ from multipledispatch import dispatch
 #TODO: redo much of this in a different way maybe
 #  or just add global state
 
+class class_slot(NamedTuple):
+    "A sound class a match passed through, and the index of the sound in it that matched."
+    sound_class: sound_class
+    index: int
+
+# the class slots of a match are kept as a tree: None for no slots, a single class_slot,
+# or a tuple of trees (in order), so merging two matches never copies either's slots
+_slot_tree = Optional[Union[class_slot, tuple]]
+
+def _flatten_slots(tree: _slot_tree) -> list[class_slot]:
+    slots = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if type(node) is class_slot:
+            slots.append(node)
+        else:
+            stack.extend(reversed(node))
+    return slots
+
+
 #TODO: make better names for things
-@dataclass
 class match_data():
-    start: int
-    end: int
-    contents: str = ""
-    matched_sound_classes: list[sound_class] = field(default_factory = list)
-    
+    """A match, kept as just its span of the word (and any class slots), since most matches are
+    thrown away (by environments, or inside larger expressions) before anything needs their contents."""
+    __slots__ = ("start", "end", "word", "_slots")
+
+    def __init__(self, start: int, end: int, word: str = "", slots: _slot_tree = None):
+        self.start = start
+        self.end = end
+        self.word = word
+        self._slots = slots
+
+    @property
+    def contents(self) -> str:
+        return self.word[self.start:self.end]
+
+    @property
+    def class_slots(self) -> list[class_slot]:
+        return _flatten_slots(self._slots)
+
+    @property
+    def matched_sound_classes(self) -> list[sound_class]:
+        return [slot.sound_class for slot in self.class_slots]
+
     def __str__(self):
         return self.contents
 
+    def __repr__(self):
+        return f"match_data({self.start}, {self.end}, {self.contents!r}, {self.class_slots!r})"
+
 def merge_matches(first: match_data, second: match_data,/) -> match_data:
     if first.end == second.start:
-        return match_data(
-                start = first.start,
-                end = second.end,
-                contents = first.contents + second.contents,
-                matched_sound_classes = first.matched_sound_classes + second.matched_sound_classes
-            )
+        if first._slots is None:
+            slots = second._slots
+        elif second._slots is None:
+            slots = first._slots
+        else:
+            slots = (first._slots, second._slots)
+        return match_data(first.start, second.end, first.word, slots)
     else:
         raise ValueError("Matches must be consecutive to be merged!")
 
 
-# all calls to _match must have word and pos as keyword arguments due to how @dispatch
+class work_limit_error(Exception):
+    pass
+
+class work_counter:
+    "Counts the matching steps taken applying a rule to a word, giving up once there have been more than limit."
+    __slots__ = ("limit", "steps")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.steps = 0
+
+    def add(self, steps: int = 1):
+        self.steps += steps
+        if self.steps > self.limit:
+            raise work_limit_error(f"Gave up after {self.limit} matching steps")
+
+
+# all calls to _match must have word and pos (and counter) as keyword arguments due to how @dispatch
 # dispatches on ALL non-keyword arguments
 
 @dispatch(sound_node)
-def _match(node: sound_node, word: str, pos: int) -> Iterable[match_data]:
+def _match(node: sound_node, word: str, pos: int, counter: work_counter = None) -> Iterable[match_data]:
     end_pos = pos + len(node.sound)
     if word[pos: end_pos] == node.sound:
-        match = match_data(pos, end_pos)
-        match.contents = node.sound
-        yield match
+        yield match_data(pos, end_pos, word)
 
 @dispatch(optional_node)
-def _match(node: optional_node, word: str, pos: int):
-    yield from _match(node.expression, word = word, pos = pos)
-    yield match_data(pos, pos) # 0-length match can be merged with other matches in a larger expression
+def _match(node: optional_node, word: str, pos: int, counter: work_counter = None):
+    yield from _match(node.expression, word = word, pos = pos, counter = counter)
+    yield match_data(pos, pos, word) # 0-length match can be merged with other matches in a larger expression
 
 @dispatch(sound_list_node)
-def _match(node: sound_list_node, word: str, pos: int):
+def _match(node: sound_list_node, word: str, pos: int, counter: work_counter = None):
     for expr in node.expressions:
-        yield from _match(expr, word = word, pos = pos)
+        yield from _match(expr, word = word, pos = pos, counter = counter)
 
 @dispatch(sound_class_node)
-def _match(node: sound_class_node, word: str, pos: int):
-    for sound in node.sound_class:
+def _match(node: sound_class_node, word: str, pos: int, counter: work_counter = None):
+    for idx, sound in enumerate(node.sound_class):
         end_pos = pos + len(sound)
         if word[pos: end_pos] == sound:
-            yield match_data(pos, end_pos, sound, [node.sound_class])
+            yield match_data(pos, end_pos, word, class_slot(node.sound_class, idx))
             break # only ever match a single sound
 
 @dispatch(expression_node)
-def _match(node: expression_node, word: str, pos: int) -> Iterable[match_data]:
+def _match(node: expression_node, word: str, pos: int, counter: work_counter = None) -> Iterable[match_data]:
+    if not node.elements:
+        # an empty expression, like either side of "_x", always matches without consuming anything
+        yield match_data(pos, pos, word)
+        return
     # seek through the word, attempting to match each element successively
     element = node.elements[0]
     result: match_data
-    for result in _match(element, word = word,  pos = pos):
+    for result in _match(element, word = word,  pos = pos, counter = counter):
+        if counter is not None:
+            counter.add()
         if len(node.elements) > 1:
-            for m in _match(expression_node(node.elements[1:]), word = word, pos = result.end):
+            for m in _match(expression_node(node.elements[1:]), word = word, pos = result.end, counter = counter):
                 yield merge_matches(result, m)
         else:
             yield result
 
 # skip anything unimplemented for now, returning an empty match for compatability with other code
 @dispatch(ast_node)
-def _match(node: ast_node, word: str, pos: int):
+def _match(node: ast_node, word: str, pos: int, counter: work_counter = None):
     warn(f"Matching currently unimplemented for {node.__class__.__name__} type nodes")
-    yield match_data(pos, pos)
+    yield match_data(pos, pos, word)
+
+
+def get_first_match(expression: expression_node, word: str, pos: int,
+                    counter: work_counter = None) -> Optional[match_data]:
+    return next(_match(expression, word = word, pos = pos, counter = counter), None)
+
+
+class memoized_matcher:
+    """Finds the same first matches in a word as get_first_match, without trying every combination of alternatives.
+
+    Of all the ways part of an expression can match at a position, only the first to end at each place can be
+    part of a first match, as any later one ending there would be followed by the same matches of the rest.
+    Keeping just those, for each part of an expression at each position, bounds the work by the word's length
+    instead of by the number of combinations. It's slower than _match for rules with few of them, though,
+    as it finds every way of matching up front instead of stopping at the first."""
+
+    def __init__(self, word: str, counter: work_counter = None):
+        self.word = word
+        self.counter = counter
+        # (id of node, how many of its elements are skipped, position) -> matches, with the first to end at each place
+        self.memo: dict[tuple[int, int, int], list[match_data]] = {}
+
+    def first_match(self, expression: expression_node, pos: int) -> Optional[match_data]:
+        matches = self._matches(expression, pos)
+        return matches[0] if matches else None
+
+    def _matches(self, node: ast_node, pos: int, skipped: int = 0) -> list[match_data]:
+        key = (id(node), skipped, pos)
+        matches = self.memo.get(key)
+        if matches is None:
+            matches = self.memo[key] = self._find_matches(node, pos, skipped)
+            if self.counter is not None:
+                self.counter.add(len(matches) + 1)
+        return matches
+
+    def _find_matches(self, node: ast_node, pos: int, skipped: int) -> list[match_data]:
+        word = self.word
+        match node:
+            case sound_node(sound = sound):
+                return [match_data(pos, pos + len(sound), word)] if word.startswith(sound, pos) else []
+            case sound_class_node(sound_class = sounds):
+                for idx, sound in enumerate(sounds):
+                    if word.startswith(sound, pos):
+                        return [match_data(pos, pos + len(sound), word, class_slot(sounds, idx))]
+                return []
+            case optional_node(expression = expression):
+                return _first_per_end(chain(self._matches(expression, pos), [match_data(pos, pos, word)]))
+            case sound_list_node(expressions = expressions):
+                return _first_per_end(chain.from_iterable(self._matches(expr, pos) for expr in expressions))
+            case expression_node(elements = elements):
+                if not elements:
+                    return [match_data(pos, pos, word)]
+                if skipped == len(elements) - 1:
+                    return self._matches(elements[-1], pos)
+                return _first_per_end(merge_matches(first, rest) for first in self._matches(elements[skipped], pos)
+                                      for rest in self._matches(node, first.end, skipped + 1))
+            case _:
+                warn(f"Matching currently unimplemented for {node.__class__.__name__} type nodes")
+                return [match_data(pos, pos, word)]
 
+def _first_per_end(matches: Iterable[match_data]) -> list[match_data]:
+    ends = set()
+    firsts = []
+    for match in matches:
+        if match.end not in ends:
+            ends.add(match.end)
+            firsts.append(match)
+    return firsts
 
-def get_first_match(expression: expression_node, word: str, pos: int) -> Optional[match_data]:
-    return next(_match(expression, word = word, pos = pos), None)
 
-def match_change(change: change_node, word: str) -> list[match_data]:
+def match_change(change: change_node, word: str, counter: work_counter = None, memoize: bool = False) -> list[match_data]:
     matches: list[match_data] = []
+    memoized = memoized_matcher(word, counter) if memoize else None
     idx = 0
     while idx < len(word):
+        if counter is not None:
+            counter.add()
         # the _match implementation will generate every possible match for the rule at a given position;
         # we only take the first (if any)
-        match_result: match_data = get_first_match(change.target[0], word, idx)
+        if memoized:
+            match_result = memoized.first_match(change.target[0], idx)
+        else:
+            match_result: match_data = get_first_match(change.target[0], word, idx, counter)
         if match_result is not None:
             matches.append(match_result)
             idx = match_result.end
@@ -101,17 +238,107 @@ def match_change(change: change_node, word: str) -> list[match_data]:
     return matches
 
 
-def environment_works(env: environment_node, word: str, match: match_data) -> bool:
+def environment_works(env: environment_node, word: str, match: match_data, counter: work_counter = None,
+                      memoize: bool = False) -> bool:
     word_before_match = word[:match.start]
     # instead of writing reversed matching logic for pre-environments,
     # we may reverse the environment and the part of the word of interest
     # and do a forwards match
     # TODO: fix this breaking with multigraphs
-    pre_match = get_first_match(_reverse_node(env.pre_expression), word = "".join(reversed(word_before_match)), pos = 0)
+    reversed_word = "".join(reversed(word_before_match))
+    if memoize:
+        pre_match = memoized_matcher(reversed_word, counter).first_match(_reverse_node(env.pre_expression), 0)
+    else:
+        pre_match = get_first_match(_reverse_node(env.pre_expression), word = reversed_word, pos = 0, counter = counter)
+    # a positive environment works when both sides match, a negative one when they don't both match,
+    # so if the pre-environment doesn't match the post-environment can't change anything
+    if pre_match is None:
+        return not env.is_positive
     # post-environments don't need anything fancy
-    post_match = get_first_match(env.post_expression, word, pos = match.end)
+    if memoize:
+        post_match = memoized_matcher(word, counter).first_match(env.post_expression, match.end)
+    else:
+        post_match = get_first_match(env.post_expression, word, pos = match.end, counter = counter)
+
+    return (post_match is not None) == env.is_positive
+
+
+class environment_checker:
+    """Decides whether a rule's environments allow a match, with the same result as checking
+    every negative environment and then any positive environment in order, but cheaper.
+
+    Keeps running statistics on how often each environment settles the question (a negative one failing,
+    or a positive one working) and how long it takes to check, and periodically reorders the checks so that
+    those most likely to settle things soonest for their cost go first, negative and positive interleaved.
+    When the written order is already a good one this gains nothing, but the bookkeeping costs too little to
+    measure; when a cheap, decisive environment comes after expensive ones, it can halve the time spent."""
+
+    # how many evaluations between reorderings
+    reorder_interval = 256
+    # only every this many evaluations are timed, to keep the bookkeeping cheap
+    timing_interval = 16
+
+    def __init__(self, negative_environments: list[environment_node], positive_environments: list[environment_node]):
+        # pairs of (environment, is it one of the positive ones)
+        self.checks = [(env, False) for env in negative_environments] + [(env, True) for env in positive_environments]
+        self.positive_count = len(positive_environments)
+        self.order = list(range(len(self.checks)))
+
+        self.evaluations = 0
+        self.calls = [0] * len(self.checks)
+        self.decisions = [0] * len(self.checks)
+        self.timed_calls = [0] * len(self.checks)
+        self.time_spent = [0] * len(self.checks)
+
+    def _expected_cost(self, idx: int) -> float:
+        # with nothing timed yet, every check is assumed to cost the same
+        cost = self.time_spent[idx] / self.timed_calls[idx] if self.timed_calls[idx] else 1.0
+        # smoothed, so that a check that has never settled anything still gets a (small) chance
+        decisiveness = (self.decisions[idx] + 1) / (self.calls[idx] + 2)
+        return cost / decisiveness
+
+    def _reorder(self):
+        # sorting is stable, so ties keep their current order
+        self.order.sort(key = self._expected_cost)
+
+    def allows(self, word: str, match: match_data, counter: work_counter = None, memoize: bool = False) -> bool:
+        self.evaluations += 1
+        if self.evaluations % self.reorder_interval == 0:
+            self._reorder()
+        timed = self.evaluations % self.timing_interval == 0
 
-    return (bool(pre_match) == env.is_positive) and (bool(post_match) == env.is_positive)
+        positives_left = self.positive_count
+        positive_found = not positives_left
+
+        for idx in self.order:
+            env, is_positive = self.checks[idx]
+            if is_positive and positive_found:
+                # one positive environment working is enough
+                continue
+
+            self.calls[idx] += 1
+            if timed:
+                start = perf_counter_ns()
+                works = environment_works(env, word, match, counter, memoize)
+                self.time_spent[idx] += perf_counter_ns() - start
+                self.timed_calls[idx] += 1
+            else:
+                works = environment_works(env, word, match, counter, memoize)
+
+            if is_positive:
+                if works:
+                    self.decisions[idx] += 1
+                    positive_found = True
+                else:
+                    positives_left -= 1
+                    if not positives_left:
+                        # every positive environment failed
+                        return False
+            elif not works:
+                self.decisions[idx] += 1
+                return False
+
+        return positive_found
 
 
 def _reverse_node(node: ast_node) -> ast_node:
@@ -135,3 +362,27 @@ def _reverse_node(node: ast_node) -> ast_node:
             return node
         case _:
             raise ValueError(f"Reversing not supported on nodes of type {type(node)}")
+
+
+# rules that can try more ways than this of matching at a single position are matched with memoized_matcher
+memoize_threshold = 1024
+
+def match_paths(node: ast_node) -> int:
+    """The most ways _match can try to match node at a position, all of which it tries when nothing matches there.
+    Each optional doubles this for the expression it's in, and each list multiplies it by its length."""
+    match node:
+        case expression_node(elements = elms):
+            return prod(match_paths(e) for e in elms)
+        case sound_list_node(expressions = exprs):
+            return sum(match_paths(e) for e in exprs)
+        case optional_node(expression = e):
+            return match_paths(e) + 1
+        case _:
+            return 1
+
+def rule_match_paths(rule: rule_node) -> int:
+    "The most ways any target or environment of a rule can try to match at a position."
+    expressions = [change.target[0] for change in rule.changes if change.target]
+    for env in rule.positive_environments + rule.negative_environments:
+        expressions += [env.pre_expression, env.post_expression]
+    return max(map(match_paths, expressions), default = 1)
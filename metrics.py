@@ -0,0 +1,152 @@
+
+from __future__ import annotations
+
+import json
+import sys
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import ContextManager, Iterator, TextIO
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, where peak RSS just isn't reported
+    resource = None
+
+
+def peak_rss_bytes() -> int:
+    "The most memory this process has had resident at once so far, or 0 where that can't be found out."
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class phase_metrics:
+    """Totals for one phase of a run, over every time it was entered.
+    Phases like tokenizing are entered once per rule, the rest once per run."""
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    # net bytes still allocated at the end of the phase that weren't at its start
+    allocated_bytes: int = 0
+    # the most traced memory allocated during any one call of the phase, above what was allocated when it started
+    peak_allocated_bytes: int = 0
+    # the process's peak RSS as of the end of the phase
+    peak_rss_bytes: int = 0
+
+
+@dataclass
+class rate_sample:
+    "Throughput of a single rule, taken as it finishes."
+    seconds: float
+    rules_done: int
+    words: int
+    words_per_second: float
+
+
+class run_metrics:
+    """Records how long each phase of a run takes, how much memory it allocates and how big
+    the process gets, along with throughput after every rule.
+
+    Pass one as metrics to parse_rule_file, apply_rules, change_sounds and so on to have them fill it in.
+    Allocations are only traced (with tracemalloc) when trace_allocations is set, since tracing
+    slows everything down considerably. Phases shouldn't be nested, as each resets the traced peak."""
+
+    def __init__(self, trace_allocations: bool = True):
+        self.trace_allocations = trace_allocations
+        self.phases: dict[str, phase_metrics] = {}
+        self.samples: list[rate_sample] = []
+        self.start_time = perf_counter()
+        self._last_sample_time = None
+
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[phase_metrics]:
+        metrics = self.phases.setdefault(name, phase_metrics(name))
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            start_allocated, _ = tracemalloc.get_traced_memory()
+        start = perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.seconds += perf_counter() - start
+            metrics.calls += 1
+            if self.trace_allocations:
+                allocated, peak = tracemalloc.get_traced_memory()
+                metrics.allocated_bytes += allocated - start_allocated
+                metrics.peak_allocated_bytes = max(metrics.peak_allocated_bytes, peak - start_allocated)
+            metrics.peak_rss_bytes = peak_rss_bytes()
+
+    def start_rules(self):
+        "Marks the start of applying rules, so the first rule's throughput is measured from here."
+        self._last_sample_time = perf_counter()
+
+    def rule_done(self, rules_done: int, word_count: int):
+        now = perf_counter()
+        if self._last_sample_time is None:
+            self._last_sample_time = self.start_time
+        elapsed = now - self._last_sample_time
+        self._last_sample_time = now
+        self.samples.append(rate_sample(now - self.start_time, rules_done, word_count,
+                                        word_count / elapsed if elapsed > 0 else 0.0))
+
+    def stop(self):
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": perf_counter() - self.start_time,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "phases": [asdict(phase) for phase in self.phases.values()],
+            "samples": [asdict(sample) for sample in self.samples],
+        }
+
+    def write_json(self, out: TextIO):
+        json.dump(self.to_dict(), out, indent = 2)
+        out.write("\n")
+
+    def write_prometheus(self, out: TextIO):
+        "Writes a snapshot in the Prometheus text exposition format."
+        def metric(name: str, help_text: str, values: list[tuple[str, float]]):
+            out.write(f"# HELP sound_changer_{name} {help_text}\n")
+            out.write(f"# TYPE sound_changer_{name} gauge\n")
+            for labels, value in values:
+                out.write(f"sound_changer_{name}{labels} {value}\n")
+
+        def by_phase(attribute: str) -> list[tuple[str, float]]:
+            return [(f'{{phase="{phase.name}"}}', getattr(phase, attribute)) for phase in self.phases.values()]
+
+        metric("run_seconds", "Time since metrics started being recorded.", [("", perf_counter() - self.start_time)])
+        metric("peak_rss_bytes", "Peak resident set size of the process.", [("", peak_rss_bytes())])
+        metric("phase_seconds", "Total time spent in each phase.", by_phase("seconds"))
+        metric("phase_calls", "Number of times each phase was entered.", by_phase("calls"))
+        metric("phase_allocated_bytes", "Net bytes allocated by each phase.", by_phase("allocated_bytes"))
+        metric("phase_peak_allocated_bytes", "Peak bytes allocated during a single call of each phase.",
+               by_phase("peak_allocated_bytes"))
+        metric("phase_peak_rss_bytes", "Peak resident set size as of the end of each phase.", by_phase("peak_rss_bytes"))
+        metric("rule_words_per_second", "Throughput of each rule.",
+               [(f'{{rule="{sample.rules_done}"}}', sample.words_per_second) for sample in self.samples])
+
+    def write(self, path: str, out_format: str = None):
+        "Writes a snapshot to a file, as prometheus text if the format or file extension (.prom) says so, otherwise json."
+        if out_format is None:
+            out_format = "prometheus" if path.endswith(".prom") else "json"
+        with open(path, "w", encoding = "utf-8") as out_file:
+            if out_format == "prometheus":
+                self.write_prometheus(out_file)
+            else:
+                self.write_json(out_file)
+
+
+def measure(metrics: run_metrics | None, name: str) -> ContextManager:
+    "A phase of metrics, or a context that does nothing if there are no metrics to record."
+    return metrics.phase(name) if metrics else nullcontext()
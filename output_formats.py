@@ -0,0 +1,130 @@
+
+from __future__ import annotations
+
+from io import TextIOWrapper
+from itertools import islice
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+
+# how many lines are joined together before being handed to the file
+_chunk_size = 4096
+
+# binary output starts with this, followed by the line index of the first word and the word count,
+# then one record per changed word
+_binary_magic = b"SCHG\x02"
+
+
+def _chunks(lines: Iterable[str]) -> Iterator[list[str]]:
+    lines = iter(lines)
+    while chunk := list(islice(lines, _chunk_size)):
+        yield chunk
+
+def _write_lines(out_file: TextIOWrapper, lines: Iterable[str]):
+    """Writes lines separated by newlines (with no trailing newline), a chunk at a time.
+    Avoids building the whole output in memory while still keeping the number of writes down."""
+    separator = ""
+    for chunk in _chunks(lines):
+        out_file.write(separator)
+        out_file.write("\n".join(chunk))
+        separator = "\n"
+
+
+def _changed_lines(word_list: list[str], original_words: list[str], first_line: int) -> Iterator[tuple[int, str, str]]:
+    for line, (original, word) in enumerate(zip(original_words, word_list), start = first_line):
+        if original != word:
+            yield line, original, word
+
+
+def write_plain(out_file: TextIOWrapper, word_list: list[str], original_words: list[str] = None, first_line: int = 0):
+    "Writes just the changed lexicon, one word per line."
+    _write_lines(out_file, word_list)
+
+def write_pairs(out_file: TextIOWrapper, word_list: list[str], original_words: list[str], first_line: int = 0):
+    "Writes a tab-separated line of input and output for every word."
+    _write_lines(out_file, (f"{original}\t{word}" for original, word in zip(original_words, word_list)))
+
+def write_changed(out_file: TextIOWrapper, word_list: list[str], original_words: list[str], first_line: int = 0):
+    """Writes only the words a rule changed, as tab-separated lines of line index, input and output.
+    first_line is the lexicon line index of the first word, for when only part of a lexicon was changed."""
+    _write_lines(out_file, (f"{line}\t{original}\t{word}" for line, original, word
+        in _changed_lines(word_list, original_words, first_line)))
+
+
+def _encode_uvarint(number: int) -> bytes:
+    encoded = bytearray()
+    while number >= 0x80:
+        encoded.append((number & 0x7f) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+def _decode_uvarint(data: bytes, pos: int) -> tuple[int, int]:
+    number = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def write_binary(out_file: TextIOWrapper | BinaryIO, word_list: list[str], original_words: list[str], first_line: int = 0):
+    """Writes only the words a rule changed in a compact binary form:
+    the header, the line index of the first word (first_line), the number of words, then for each changed word
+    the distance in lines from the last changed word (or from first_line), the length of the new word in bytes
+    and the new word itself, all as unsigned LEB128 varints and utf-8.
+
+    The original lexicon is needed to read this back; see read_binary_output."""
+    if isinstance(out_file, TextIOWrapper):
+        # write underneath the text layer, making sure anything already written to it goes first
+        out_file.flush()
+        out_file = out_file.buffer
+
+    buffer = bytearray(_binary_magic)
+    buffer += _encode_uvarint(first_line)
+    buffer += _encode_uvarint(len(word_list))
+    last_line = first_line
+    for line, _, word in _changed_lines(word_list, original_words, first_line):
+        encoded = word.encode("utf-8")
+        buffer += _encode_uvarint(line - last_line)
+        buffer += _encode_uvarint(len(encoded))
+        buffer += encoded
+        last_line = line
+        if len(buffer) >= _chunk_size * 16:
+            out_file.write(buffer)
+            buffer.clear()
+    out_file.write(buffer)
+    out_file.flush()
+
+
+def read_binary_output(data: bytes, original_words: list[str]) -> list[str]:
+    """Reconstructs the full changed lexicon from binary output and the whole lexicon it was made from.
+    Output of a run on only some lines (with --lines) changes just those lines of the lexicon."""
+    if not data.startswith(_binary_magic):
+        raise ValueError("Not binary sound changer output")
+    pos = len(_binary_magic)
+    first_line, pos = _decode_uvarint(data, pos)
+    count, pos = _decode_uvarint(data, pos)
+    if first_line + count > len(original_words):
+        raise ValueError(f"Output is for lines {first_line} to {first_line + count}, "
+                         f"but only {len(original_words)} words were given")
+
+    word_list = list(original_words)
+    line = first_line
+    while pos < len(data):
+        delta, pos = _decode_uvarint(data, pos)
+        length, pos = _decode_uvarint(data, pos)
+        line += delta
+        word_list[line] = data[pos:pos + length].decode("utf-8")
+        pos += length
+    return word_list
+
+
+output_formats: dict[str, Callable[[TextIOWrapper, list[str], list[str], int], None]] = {
+    "plain": write_plain,
+    "pairs": write_pairs,
+    "changed": write_changed,
+    "binary": write_binary,
+}
@@ -1,11 +1,15 @@
 
 from __future__ import annotations
 
+from dataclasses import replace
 from io import TextIOWrapper
 from itertools import chain, product
+from warnings import warn
 
 import regex as re
 
+from matcher import memoize_threshold, rule_match_paths
+from metrics import measure, run_metrics
 from regex_util import *
 from rule_ast import rule_node, parse_tokens
 from rule_tokenizer import tokenize_rule
@@ -124,14 +128,29 @@ def parse_sound_classes(file: TextIOWrapper) -> int:
 ######################################################################################################################
 # rule stuff here
 
-def parse_rule(rule_str: str, linenum: int, sound_classes: dict[str, sound_class]) -> rule_node:
-    tokens = tokenize_rule(rule_str, sound_classes, sound_classes["_ALL"])
-
-    return parse_tokens(tokens, sound_classes)
-
-
-
-def parse_rules(file: TextIOWrapper, start_line: int, classes: dict[str, sound_class]) -> list[rule_node]:
+def parse_rule(rule_str: str, linenum: int, sound_classes: dict[str, sound_class],
+               metrics: run_metrics = None) -> rule_node:
+    with measure(metrics, "tokenizing"):
+        tokens = tokenize_rule(rule_str, sound_classes, sound_classes["_ALL"])
+
+    with measure(metrics, "parse_tokens"):
+        rule = parse_tokens(tokens, sound_classes)
+    rule.source, rule.linenum = rule_str, linenum
+
+    # a match that fails tries every combination of optionals and lists, which can take forever on long words
+    paths = rule_match_paths(rule)
+    if paths > memoize_threshold:
+        warn(f"Line {linenum}: rule \"{rule_str}\" can try up to {paths} ways of matching at each position in a word, "
+             "so it will be matched by remembering partial matches instead, which is slower for most rules")
+        rule.memoize = True
+    return rule
+
+
+def parse_rules(file: TextIOWrapper, start_line: int, classes: dict[str, sound_class],
+                metrics: run_metrics = None, cache: dict[str, rule_node] = None) -> list[rule_node]:
+    """Parses every rule in file. If given, cache maps rule text to already parsed rules, which are reused
+    instead of parsing the same text again, and is filled in with any new ones.
+    The cache must be emptied whenever the classes change."""
     rule_list: list[rule_node] = []
 
     try:
@@ -142,8 +161,18 @@ def parse_rules(file: TextIOWrapper, start_line: int, classes: dict[str, sound_c
                 # skip comments and blank lines
                 continue
 
+            elif cache is not None and line in cache:
+                rule = cache[line]
+                if rule.linenum != linenum:
+                    # the rule has moved, and its line number is what errors and warnings about it report
+                    rule = cache[line] = replace(rule, linenum = linenum)
+                rule_list.append(rule)
+
             else:
-                rule_list.append(parse_rule(line, linenum, classes))
+                rule = parse_rule(line, linenum, classes, metrics)
+                if cache is not None:
+                    cache[line] = rule
+                rule_list.append(rule)
 
     except parse_error as error:
         # add info about the rule and line that a parse error happend on to the exception and reraise it
@@ -159,10 +188,11 @@ def parse_rules(file: TextIOWrapper, start_line: int, classes: dict[str, sound_c
 #########################################################################################################################
 # overall parsing
 
-def parse_rule_file(file: TextIOWrapper):
-    classes, offset = parse_sound_classes(file)
+def parse_rule_file(file: TextIOWrapper, metrics: run_metrics = None):
+    with measure(metrics, "class_parsing"):
+        classes, offset = parse_sound_classes(file)
 
-    rules = parse_rules(file, offset, classes)
+    rules = parse_rules(file, offset, classes, metrics)
 
     return rules
 
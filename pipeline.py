@@ -0,0 +1,218 @@
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import sys
+import threading
+import traceback
+from dataclasses import dataclass
+from itertools import chain, islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from applier import apply_rule, apply_rules
+from matcher import environment_checker
+from parsing import parse_rule_file
+from rule_ast import rule_node
+
+
+#########################################################################################################################
+# splitting rules into stages
+
+def measure_rule_costs(rule_list: list[rule_node], sample_words: list[str]) -> list[float]:
+    """Times each rule over a sample of the lexicon, in order, so that each rule sees the sample
+    as it would be by the time that rule is reached."""
+    words = list(sample_words)
+    costs = []
+    for rule in rule_list:
+        start = perf_counter()
+        apply_rules([rule], words)
+        costs.append(perf_counter() - start)
+    return costs
+
+
+def _stages_needed(costs: list[float], limit: float) -> int:
+    "How many contiguous stages the greedy split makes if no stage may cost more than limit."
+    stages = 1
+    current = 0.0
+    for cost in costs:
+        if current + cost > limit and current > 0:
+            stages += 1
+            current = 0.0
+        current += cost
+    return stages
+
+
+def split_stages(costs: list[float], stage_count: int) -> list[tuple[int, int]]:
+    """Splits rules with the given costs into at most stage_count contiguous (start, stop) ranges,
+    keeping the most expensive stage as cheap as possible, since that stage limits the whole pipeline."""
+    if not costs:
+        return []
+    stage_count = max(1, min(stage_count, len(costs)))
+    if not any(costs):
+        # nothing measured (e.g. an empty sample), so treat every rule alike
+        costs = [1.0] * len(costs)
+
+    # binary search for the smallest maximum stage cost that still fits in stage_count stages
+    low, high = max(costs), sum(costs)
+    for _ in range(64):
+        if high - low <= high * 1e-9:
+            break
+        mid = (low + high) / 2
+        if _stages_needed(costs, mid) <= stage_count:
+            high = mid
+        else:
+            low = mid
+
+    bounds = []
+    start = 0
+    current = 0.0
+    for idx, cost in enumerate(costs):
+        if current + cost > high and current > 0:
+            bounds.append((start, idx))
+            start = idx
+            current = 0.0
+        current += cost
+    bounds.append((start, len(costs)))
+    return bounds
+
+
+#########################################################################################################################
+# running stages
+
+@dataclass
+class _stage_failure:
+    "Sent down the pipeline in place of a batch when a stage fails."
+    stage: int
+    error: str
+
+
+def _stage_function(rule_list: list[rule_node], engine: str) -> Callable[[str], str]:
+    if engine == "compiled":
+        from transducer import compile_rules, rule_cascade
+        stages = compile_rules(rule_list)
+        def apply(word: str) -> str:
+            for stage in stages:
+                word = stage(word) if isinstance(stage, rule_cascade) else apply_rule(stage, word)
+            return word
+
+    else:
+        # one checker per rule, kept for the life of the stage so it can learn across batches
+        checkers = [environment_checker(rule.negative_environments, rule.positive_environments)
+                    if len(rule.positive_environments) + len(rule.negative_environments) > 1 else None
+                    for rule in rule_list]
+        def apply(word: str) -> str:
+            for rule, checker in zip(rule_list, checkers):
+                word = apply_rule(rule, word, checker)
+            return word
+
+    return apply
+
+
+def _stage_worker(stage: int, rule_list: list[rule_node], engine: str,
+                  in_queue: multiprocessing.Queue, out_queue: multiprocessing.Queue):
+    try:
+        apply = _stage_function(rule_list, engine)
+    except Exception:
+        apply = None
+        out_queue.put(_stage_failure(stage, traceback.format_exc()))
+
+    failed = apply is None
+    # batches keep flowing (and being dropped) after a failure, so that earlier stages never block on a full queue
+    while (batch := in_queue.get()) is not None:
+        if failed:
+            continue
+        if isinstance(batch, _stage_failure):
+            out_queue.put(batch)
+            failed = True
+            continue
+        try:
+            out_queue.put([apply(word) for word in batch])
+        except Exception:
+            out_queue.put(_stage_failure(stage, traceback.format_exc()))
+            failed = True
+    out_queue.put(None)
+
+
+def _batches(words: Iterable[str], batch_size: int) -> Iterator[list[str]]:
+    words = iter(words)
+    while batch := list(islice(words, batch_size)):
+        yield batch
+
+
+def run_pipeline(rule_list: list[rule_node], words: Iterable[str], stage_count: int = None, batch_size: int = 256,
+                 queue_size: int = 8, sample_size: int = 200, engine: str = "interpreter") -> Iterator[str]:
+    """Applies rules to a stream of words, with the rules split into contiguous stages that each
+    run in their own process. Words pass between stages in batches through bounded queues, so memory
+    stays bounded however long the input is, and every word still sees every rule in order.
+
+    Stages are balanced by how long each rule takes on the first sample_size words.
+    Yields the changed words in input order."""
+    stage_count = stage_count or multiprocessing.cpu_count()
+
+    words = iter(words)
+    sample = list(islice(words, sample_size))
+    words = chain(sample, words)
+    bounds = split_stages(measure_rule_costs(rule_list, sample), stage_count)
+
+    if not bounds:
+        # no rules, nothing to do
+        yield from words
+        return
+
+    queues = [multiprocessing.Queue(maxsize = queue_size) for _ in range(len(bounds) + 1)]
+    workers = [multiprocessing.Process(target = _stage_worker, daemon = True,
+                                       args = (stage, rule_list[start:stop], engine, queues[stage], queues[stage + 1]))
+               for stage, (start, stop) in enumerate(bounds)]
+    for worker in workers:
+        worker.start()
+
+    # feed from a thread, since the first queue can fill up while this generator is waiting on the last
+    def feed():
+        for batch in _batches(words, batch_size):
+            queues[0].put(batch)
+        queues[0].put(None)
+    feeder = threading.Thread(target = feed, daemon = True)
+    feeder.start()
+
+    try:
+        while (batch := queues[-1].get()) is not None:
+            if isinstance(batch, _stage_failure):
+                raise RuntimeError(f"Pipeline stage {batch.stage} failed:\n{batch.error}")
+            yield from batch
+        feeder.join()
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for queue in queues:
+            queue.cancel_join_thread()
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Stream a lexicon through rules split into parallel stages.")
+
+    parser.add_argument("rules_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    parser.add_argument("lex_file", action = "store", nargs = "?", default = sys.stdin,
+        type = argparse.FileType("r", encoding = "utf-8"), help = "defaults to standard input")
+    parser.add_argument("-o", "--out", action = "store", type = argparse.FileType("w", encoding = "utf-8"),
+        dest = "out_file", default = sys.stdout)
+    parser.add_argument("-k", "--stages", action = "store", type = int, default = None,
+        help = "number of stages (worker processes); defaults to the number of CPUs")
+    parser.add_argument("--batch-size", action = "store", type = int, default = 256)
+    parser.add_argument("--engine", action = "store", choices = ("interpreter", "compiled"), default = "interpreter")
+
+    args = parser.parse_args()
+
+    rule_list = parse_rule_file(args.rules_file)
+    words = (line.strip() for line in args.lex_file)
+
+    # one word per line, as they come, rather than write_output's single block
+    for word in run_pipeline(rule_list, words, args.stages, args.batch_size, engine = args.engine):
+        args.out_file.write(word + "\n")
+    args.out_file.flush()
@@ -21,10 +21,10 @@ class replacer:
 
     @dispatch(sound_class_node)
     def _replace(self, node: sound_class_node, data: match_data) -> str:
-        matched_class = data.matched_sound_classes[self.sound_classes_seen]
+        # the match already knows which sound of the matched class it went through
+        _, sound_idx = data.class_slots[self.sound_classes_seen]
         self.sound_classes_seen += 1
         replacer_class = node.sound_class
-        sound_idx = matched_class.index(data.contents)
         return replacer_class[sound_idx]
 
     @dispatch(expression_node)
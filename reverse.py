@@ -0,0 +1,295 @@
+
+from __future__ import annotations
+
+import argparse
+import sys
+from dataclasses import dataclass
+from itertools import combinations
+from time import time
+from typing import Callable, Iterable, Optional
+from warnings import warn
+
+from applier import apply_rule, load_lexicon
+from parsing import parse_rule_file
+from rule_ast import rule_node
+from transducer import alternative_replacement, compile_rule, expand, not_finite
+
+
+#########################################################################################################################
+# inverting single rules
+
+@dataclass
+class _site:
+    "A place in a word where a change may have happened: word[start:end] may once have been any of ancestors."
+    start: int
+    end: int
+    ancestors: list[str]
+
+    def overlaps(self, other: _site) -> bool:
+        if self.start == self.end or other.start == other.end:
+            # nothing can be inserted twice at the same place
+            return self.start == other.start or (self.start < other.start < self.end) \
+                    or (other.start < self.start < other.end)
+        return self.start < other.end and other.start < self.end
+
+
+class rule_inverter:
+    """Proposes the words a rule could have turned into a given word.
+
+    Each change's target is expanded into every string it can match (as the compiled engine does),
+    and each of those is run through the replacer, giving a map from what the change leaves behind
+    to what it could have been. Candidates undo the change at some of the places its results appear,
+    and are only kept if applying the rule forwards really does give the word back."""
+
+    def __init__(self, rule: rule_node):
+        self.rule = rule
+        self.inverses: dict[str, list[str]] = {}
+        for change in rule.changes:
+            for alt in expand(change.target[0]):
+                if not alt.string:
+                    # a change can't have come from nothing, as a nullable target never finishes matching
+                    continue
+                result = alternative_replacement(alt, change)
+                ancestors = self.inverses.setdefault(result, [])
+                if alt.string != result and alt.string not in ancestors:
+                    ancestors.append(alt.string)
+
+        compiled = compile_rule(rule)
+        self.forward: Callable[[str], str] = compiled if compiled else lambda word: apply_rule(rule, word)
+
+    def _sites(self, word: str) -> list[_site]:
+        sites = []
+        for result, ancestors in self.inverses.items():
+            if not ancestors:
+                continue
+            if not result:
+                # a deletion could have happened anywhere
+                sites.extend(_site(pos, pos, ancestors) for pos in range(len(word) + 1))
+                continue
+            pos = word.find(result)
+            while pos != -1:
+                sites.append(_site(pos, pos + len(result), ancestors))
+                pos = word.find(result, pos + 1)
+        sites.sort(key = lambda site: (site.start, site.end))
+        return sites
+
+    def ancestors(self, word: str, max_depth: int = 3, max_candidates: int = 256) -> dict[str, int]:
+        """Returns each word the rule could have turned into word, with how many changes it undoes.
+        Undoes at most max_depth changes at once, and proposes at most max_candidates words before checking them.
+
+        Each place a change could be undone is tried on its own first, and only the places that work alone
+        are combined, which keeps the number of combinations down to something worth searching.
+        Changes that only work together are missed, except when undone everywhere at once, as a rule
+        without environments needs."""
+        candidates: dict[str, int] = {}
+        if self.forward(word) == word:
+            candidates[word] = 0
+        proposed = 1
+
+        sites = self._sites(word)
+        viable_sites = []
+        for site in sites:
+            working = [ancestor for ancestor in site.ancestors
+                       if self.forward(word[:site.start] + ancestor + word[site.end:]) == word]
+            proposed += len(site.ancestors)
+            if working:
+                viable_sites.append(_site(site.start, site.end, working))
+                for ancestor in working:
+                    candidates.setdefault(word[:site.start] + ancestor + word[site.end:], 1)
+
+        # a rule without environments changes every place it can, so try undoing all of those at once;
+        # insertions are left out, as they could go anywhere
+        everywhere = []
+        for site in sites:
+            if site.start == site.end:
+                continue
+            if not everywhere or not everywhere[-1].overlaps(site):
+                everywhere.append(site)
+        if len(everywhere) > 1:
+            for ancestor in _undo(word, tuple(everywhere)):
+                if proposed >= max_candidates:
+                    break
+                proposed += 1
+                if self.forward(ancestor) == word:
+                    candidates.setdefault(ancestor, len(everywhere))
+
+        # fewest changes undone first, since those are the likeliest
+        for depth in range(2, min(max_depth, len(viable_sites)) + 1):
+            for chosen in combinations(viable_sites, depth):
+                if any(first.overlaps(second) for first, second in zip(chosen, chosen[1:])):
+                    continue
+                for ancestor in _undo(word, chosen):
+                    if proposed >= max_candidates:
+                        return candidates
+                    if ancestor in candidates and candidates[ancestor] <= depth:
+                        continue
+                    proposed += 1
+                    if self.forward(ancestor) == word:
+                        candidates[ancestor] = min(depth, candidates.get(ancestor, depth))
+        return candidates
+
+
+def _undo(word: str, sites: tuple[_site, ...]) -> Iterable[str]:
+    "Every way of replacing the given sites of a word with one of their ancestors."
+    if not sites:
+        yield word
+        return
+    site = sites[-1]
+    for before in _undo(word[:site.start], sites[:-1]):
+        for ancestor in site.ancestors:
+            yield before + ancestor + word[site.end:]
+
+
+class unchanged_filter:
+    """Stands in for a rule whose targets can't be expanded, so can't be inverted.
+
+    Only words the rule leaves alone are kept, so every candidate still turns into the attested word,
+    but ancestors the rule did change are missed."""
+
+    def __init__(self, rule: rule_node):
+        self.rule = rule
+
+    def ancestors(self, word: str, max_depth: int = 3, max_candidates: int = 256) -> dict[str, int]:
+        return {word: 0} if apply_rule(self.rule, word) == word else {}
+
+
+def invert_rules(rule_list: list[rule_node]) -> list[rule_inverter | unchanged_filter]:
+    """Inverts every rule that can be. Those whose targets can't be expanded only
+    let through words they leave unchanged (with a warning)."""
+    inverters = []
+    for rule in rule_list:
+        try:
+            inverters.append(rule_inverter(rule))
+        except not_finite:
+            warn(f"Line {rule.linenum}: rule \"{rule.source}\" can't be reversed, as its target matches too many "
+                 "different strings, so only words it leaves unchanged will be proposed")
+            inverters.append(unchanged_filter(rule))
+    return inverters
+
+
+#########################################################################################################################
+# reversing rule lists
+
+@dataclass
+class reconstruction:
+    word: str
+    # how many changes had to be undone to reach it, across all rules; lower is more plausible,
+    # and None for a known ancestor the search didn't find, whose cost isn't known
+    cost: Optional[int]
+
+
+def _segmentable(word: str, inventory: set[str]) -> bool:
+    "Whether word can be split up entirely into sounds from inventory."
+    longest = max(map(len, inventory), default = 0)
+    reachable = [True] + [False] * len(word)
+    for end in range(1, len(word) + 1):
+        reachable[end] = any(reachable[end - size] and word[end - size: end] in inventory
+                             for size in range(1, min(longest, end) + 1))
+    return reachable[-1]
+
+
+def reverse_word(inverters: list[rule_inverter | unchanged_filter], word: str, beam_width: int = 8, max_depth: int = 3,
+                 max_candidates: int = 256, proto_lexicon: set[str] = None,
+                 inventory: set[str] = None) -> list[reconstruction]:
+    """Runs the rules backwards from an attested word, keeping the beam_width cheapest candidates after each rule.
+
+    If given, the final candidates are limited to those in proto_lexicon, and those made up only of
+    sounds in inventory. Known proto-lexicon words that the rules turn into word are always included,
+    whether or not the search found them."""
+    candidates = {word: 0}
+    for inverter in reversed(inverters):
+        next_candidates: dict[str, int] = {}
+        for candidate, cost in candidates.items():
+            for ancestor, depth in inverter.ancestors(candidate, max_depth, max_candidates).items():
+                if ancestor not in next_candidates or cost + depth < next_candidates[ancestor]:
+                    next_candidates[ancestor] = cost + depth
+        candidates = dict(sorted(next_candidates.items(), key = lambda item: (item[1], item[0]))[:beam_width])
+
+    results = [reconstruction(candidate, cost) for candidate, cost in candidates.items()
+               if (proto_lexicon is None or candidate in proto_lexicon)
+               and (inventory is None or _segmentable(candidate, inventory))]
+    return results
+
+
+class reverser:
+    """Reverses a rule list over many words, with the given beam and depth limits (see reverse_word).
+
+    With a proto-lexicon, each of its words is run forwards once and indexed by the result,
+    so attested words with a known ancestor get it straight away."""
+
+    def __init__(self, rule_list: list[rule_node], beam_width: int = 8, max_depth: int = 3, max_candidates: int = 256,
+                 proto_lexicon: Iterable[str] = None, inventory: Iterable[str] = None):
+        self.rule_list = rule_list
+        self.inverters = invert_rules(rule_list)
+        self.beam_width = beam_width
+        self.max_depth = max_depth
+        self.max_candidates = max_candidates
+        self.inventory = set(inventory) if inventory is not None else None
+
+        self.proto_lexicon = None
+        self.known_ancestors: dict[str, list[str]] = {}
+        if proto_lexicon is not None:
+            self.proto_lexicon = set(proto_lexicon)
+            for proto_word in self.proto_lexicon:
+                descendant = proto_word
+                for rule in rule_list:
+                    descendant = apply_rule(rule, descendant)
+                self.known_ancestors.setdefault(descendant, []).append(proto_word)
+
+    def __call__(self, word: str) -> list[reconstruction]:
+        results = reverse_word(self.inverters, word, self.beam_width, self.max_depth, self.max_candidates,
+                               self.proto_lexicon, self.inventory)
+        found = {result.word for result in results}
+        # known ancestors the beam missed; their cost isn't known, so they go last
+        results.extend(reconstruction(proto_word, None) for proto_word in sorted(self.known_ancestors.get(word, ()))
+                       if proto_word not in found)
+        return results
+
+
+def reverse_lexicon(rule_list: list[rule_node], word_list: list[str], **limits) -> list[list[reconstruction]]:
+    "Reconstructs possible ancestors for every word in word_list; limits are as for reverser."
+    reverse = reverser(rule_list, **limits)
+    return [reverse(word) for word in word_list]
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Propose ancestor forms for words by running the rules backwards.")
+
+    parser.add_argument("lex_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    parser.add_argument("rules_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    parser.add_argument("-o", "--out", action = "store", type = argparse.FileType("w", encoding = "utf-8"),
+        dest = "out_file", default = sys.stdout)
+    parser.add_argument("-b", "--beam", action = "store", type = int, default = 8,
+        help = "candidates kept per word after each rule")
+    parser.add_argument("-d", "--depth", action = "store", type = int, default = 3,
+        help = "most changes undone in a word by a single rule")
+    parser.add_argument("--max-candidates", action = "store", type = int, default = 256,
+        help = "most candidates proposed per word per rule")
+    parser.add_argument("--proto-lexicon", action = "store", type = argparse.FileType("r", encoding = "utf-8"),
+        default = None, help = "only propose words from this lexicon")
+    parser.add_argument("--inventory", action = "store", default = None,
+        help = "comma separated sounds that proposed words must be made up of")
+    parser.add_argument("--time", action = "store_true")
+
+    args = parser.parse_args()
+
+    if args.time:
+        start_time = time()
+
+    word_list = load_lexicon(args.lex_file)
+    rule_list = parse_rule_file(args.rules_file)
+    proto_lexicon = load_lexicon(args.proto_lexicon) if args.proto_lexicon else None
+    inventory = args.inventory.split(",") if args.inventory else None
+
+    # one line per word: the word, then its reconstructions, most plausible first
+    for word, results in zip(word_list, reverse_lexicon(rule_list, word_list, beam_width = args.beam,
+                             max_depth = args.depth, max_candidates = args.max_candidates,
+                             proto_lexicon = proto_lexicon, inventory = inventory)):
+        args.out_file.write("\t".join([word] + [result.word for result in results]) + "\n")
+    args.out_file.flush()
+
+    if args.time:
+        run_time = time() - start_time # type: ignore
+        print("Execution time: " + str(run_time), file = sys.stderr)
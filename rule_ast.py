@@ -123,7 +123,7 @@ def parse_tokens(tokens: Iterable[token], sound_classes: dict[str, sound_class])
                 # add a marker to let the parser know later which kind of environment is currently being parsed
                 if token.type is token_type.pos_slash:
                     parsing_stack.append(_marker.pos_env)
-                elif token_type is token_type.neg_slash:
+                elif token.type is token_type.neg_slash:
                     parsing_stack.append(_marker.neg_env)
 
             case token_type.underscore:
@@ -207,7 +207,7 @@ def _parse_expression_list(stack: list[ast_node | _marker]) -> expression_list_n
             # and exit the loop
             break
 
-        if peek is _marker.stack_start:
+        elif peek is _marker.stack_start:
             # we're also done
             # add the current expression to the list if there's anything in it
             if curr_expression:
@@ -223,7 +223,8 @@ def _parse_expression_list(stack: list[ast_node | _marker]) -> expression_list_n
         else:
             # we've got something that can't be a child of an expression
             # TODO: raise an appropriate error
-            pass
+            # at the very least, don't spin here forever without consuming anything
+            raise RuntimeError(f"Parsing stack in invalid state! Raw {type(peek)} left on stack during expression list collection.")
 
     expressions.reverse()
     return expression_list_node(expressions)
@@ -69,4 +69,8 @@ class rule_node(ast_node):
     changes: list[change_node]
     positive_environments: list[environment_node] = field(default_factory = list)
     negative_environments: list[environment_node] = field(default_factory = list)
+    # where the rule came from, for error messages, and how it's best matched; none of these change what it does
+    source: str = field(default = "", compare = False, repr = False)
+    linenum: int = field(default = None, compare = False, repr = False)
+    memoize: bool = field(default = False, compare = False, repr = False)
 
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Callable
+
+from applier import apply_rule
+from rule_ast import rule_node
+from transducer import alternative, alternative_replacement, compile_rule, compiled_rule
+
+
+def _common_prefix_length(first: str, second: str) -> int:
+    # binary search on startswith, which stays in C, rather than comparing a character at a time
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if second.startswith(first[:mid]):
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _shared_prefix(strings: list[str]) -> str:
+    # the shortest and longest strings in sorted order differ first wherever any two of them do
+    first, last = min(strings), max(strings)
+    return first[:_common_prefix_length(first, last)]
+
+
+def _extent(alternatives: list[alternative]) -> int:
+    "How far past where it starts matching any of the alternatives can look."
+    return max((max([len(alt.string)] + [offset + len(sound) for offset, sounds in alt.exclusions for sound in sounds])
+                for alt in alternatives), default = 0)
+
+
+# a rule as applied to one prefix node: given the prefix and the suffixes of its words, returns
+# the output for the part of the prefix that decides its result by itself, and the rest of each word's output
+node_function = Callable[[str, list[str]], tuple[str, list[str]]]
+
+
+class _prefix_rule:
+    """A compiled rule with a single change, applied to a prefix once and then to the rest of each of its words.
+
+    The scan for a change only ever looks a bounded distance ahead of where it is (window), and a bounded
+    distance behind, so everything it does more than window characters before the end of a prefix
+    is decided by the prefix alone, and is the same for every word that starts with it."""
+
+    def __init__(self, rule: compiled_rule):
+        self.rule = rule
+        self.change = rule.changes[0]
+        self.window = _extent(self.change.target.alternatives) + max(
+            [_extent(env.post.alternatives) for env in rule.positive_environments + rule.negative_environments],
+            default = 0)
+        self.has_environments = bool(rule.positive_environments or rule.negative_environments)
+        self.replacements: dict[alternative, str] = {}
+
+    def _replacement(self, alt: alternative) -> str:
+        if alt not in self.replacements:
+            self.replacements[alt] = alternative_replacement(alt, self.change.change)
+        return self.replacements[alt]
+
+    def _scan(self, word: str, idx: int, copied: int, stop: int, pieces: list[str]) -> tuple[int, int]:
+        "Scans word from idx until stop, adding output to pieces, and returns where the scan and the copying got to."
+        first_match = self.change.target.first_match
+        reversed_word = word[::-1] if self.has_environments else None
+        while idx < stop:
+            alt = first_match(word, idx)
+            if alt is None:
+                idx += 1
+                continue
+            end = idx + len(alt.string)
+            if not self.has_environments or self.rule.environments_work(word, reversed_word, idx, end):
+                pieces.append(word[copied:idx])
+                pieces.append(self._replacement(alt))
+                copied = end
+            idx = end
+        return idx, copied
+
+    def __call__(self, prefix: str, suffixes: list[str]) -> tuple[str, list[str]]:
+        first_chars = self.change.first_chars
+        if first_chars.isdisjoint(prefix) and all(first_chars.isdisjoint(suffix) for suffix in suffixes):
+            return prefix, suffixes
+
+        pieces: list[str] = []
+        idx, copied = self._scan(prefix, 0, 0, len(prefix) - self.window, pieces)
+        head = "".join(pieces)
+
+        rests = []
+        for suffix in suffixes:
+            word = prefix + suffix
+            pieces = []
+            _, word_copied = self._scan(word, idx, copied, len(word), pieces)
+            pieces.append(word[word_copied:])
+            rests.append("".join(pieces))
+        return head, rests
+
+
+def _node_function(rule: rule_node) -> node_function:
+    compiled = compile_rule(rule)
+    if compiled and len(compiled.changes) == 1:
+        return _prefix_rule(compiled)
+    apply = compiled or (lambda word: apply_rule(rule, word))
+    return lambda prefix, suffixes: ("", [apply(prefix + suffix) for suffix in suffixes])
+
+
+class _table_builder:
+    """Collects prefixes and the suffixes added to each, keeping one copy of each, then fills a shared_lexicon's
+    tables with them, merging any suffix added to the same prefix more than once."""
+
+    def __init__(self):
+        self.prefixes: list[str] = []
+        self.prefix_ids: dict[str, int] = {}
+        self.suffixes: list[str] = []
+        self.suffix_ids: dict[str, int] = {}
+        # the suffixes added to each prefix, by id, in the order they were added
+        self.added: list[array] = []
+
+    def node(self, prefix: str) -> int:
+        "The id of a prefix, which is added if it's new."
+        if prefix not in self.prefix_ids:
+            self.prefix_ids[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix)
+            self.added.append(array("i"))
+        return self.prefix_ids[prefix]
+
+    def add(self, node: int, suffix: str) -> int:
+        "Adds a suffix to a prefix, and returns how many had been added to it before."
+        if suffix not in self.suffix_ids:
+            self.suffix_ids[suffix] = len(self.suffixes)
+            self.suffixes.append(suffix)
+        added = self.added[node]
+        added.append(self.suffix_ids[suffix])
+        return len(added) - 1
+
+    def store(self, lexicon: shared_lexicon) -> list[array]:
+        "Fills lexicon's tables, and returns the entry each added suffix became, by prefix and then in the order added."
+        lexicon.prefixes = self.prefixes
+        lexicon.suffixes = self.suffixes
+        # the entries for each prefix are contiguous, from prefix_start[prefix] up to prefix_start[prefix + 1]
+        lexicon.prefix_start = array("i", [0])
+        lexicon.entry_prefix = array("i")
+        lexicon.entry_suffix = array("i")
+        for node, added in enumerate(self.added):
+            entries: dict[int, int] = {}
+            for place, suffix in enumerate(added):
+                if suffix not in entries:
+                    entries[suffix] = len(lexicon.entry_prefix)
+                    lexicon.entry_prefix.append(node)
+                    lexicon.entry_suffix.append(suffix)
+                # each place is read before it's overwritten, so the same array can hold the entries
+                added[place] = entries[suffix]
+            lexicon.prefix_start.append(len(lexicon.entry_prefix))
+        return self.added
+
+
+class shared_lexicon:
+    """A lexicon stored as shared prefixes and shared suffixes, like a two-level DAWG.
+
+    Each distinct word is a prefix node and a suffix, and each prefix and each suffix is kept once,
+    so the inflected forms of a stem share one copy of it, and every form with the same ending one copy of that.
+    Words are only indices into those tables, kept in arrays.
+
+    A rule is applied to each prefix once, as far as the prefix decides the result by itself (see _prefix_rule),
+    and then only to the rest of each of its words. The outputs are split again where they stop agreeing,
+    and prefixes that a rule makes identical are merged, along with any of their words that become the same.
+    words() expands everything back to the original order."""
+
+    def __init__(self, word_list: list[str]):
+        distinct = sorted(word_list)
+        distinct[:] = [word for idx, word in enumerate(distinct) if not idx or word != distinct[idx - 1]]
+
+        # group the distinct words in order, keeping a word with the group before it for as long as
+        # that saves more characters than the prefix loses
+        tables = _table_builder()
+        prefix, members = None, []
+        for word in distinct + [None]:
+            if prefix is not None:
+                shared = _common_prefix_length(prefix, word) if word is not None else 0
+                if shared and shared * (len(members) + 1) >= len(prefix) * len(members):
+                    prefix = prefix[:shared]
+                    members.append(word)
+                    continue
+                # a prefix can come up again after other groups; its words still come after theirs
+                node = tables.node(prefix)
+                for member in members:
+                    tables.add(node, member[len(prefix):])
+            prefix, members = word, [word]
+        entries = tables.store(self)
+
+        # every original word's place among the distinct words it started as,
+        # and where each of those is now among the current distinct words
+        self.index = array("i", (bisect_left(distinct, word) for word in word_list))
+        self.current = array("i", (entry for added in entries for entry in added))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def apply_rule(self, rule: rule_node):
+        self._apply(_node_function(rule))
+
+    def _apply(self, apply: node_function):
+        tables = _table_builder()
+        # where each current entry goes: its new prefix, and its place among the suffixes added to that
+        moved_node, moved_place = array("i"), array("i")
+        for node, prefix in enumerate(self.prefixes):
+            entries = range(self.prefix_start[node], self.prefix_start[node + 1])
+            head, rests = apply(prefix, [self.suffixes[self.entry_suffix[entry]] for entry in entries])
+            new_prefix = head + _shared_prefix(rests)
+            cut = len(new_prefix) - len(head)
+            new_node = tables.node(new_prefix)
+            for rest in rests:
+                moved_node.append(new_node)
+                moved_place.append(tables.add(new_node, rest[cut:]))
+
+        entries = tables.store(self)
+        self.current = array("i", (entries[moved_node[entry]][moved_place[entry]] for entry in self.current))
+
+    def words(self) -> list[str]:
+        prefixes, suffixes = self.prefixes, self.suffixes
+        entries = [prefixes[self.entry_prefix[entry]] + suffixes[self.entry_suffix[entry]] for entry in self.current]
+        return [entries[entry] for entry in self.index]
+
+
+def apply_rules_shared(rule_list: list[rule_node], word_list: list[str]) -> list[str]:
+    lexicon = shared_lexicon(word_list)
+    for rule in rule_list:
+        lexicon.apply_rule(rule)
+    return lexicon.words()
@@ -2,71 +2,35 @@
 from __future__ import annotations
 
 import argparse
-from io import TextIOWrapper
+import sys
 from time import time
-from matcher import environment_works, match_change
-
-from parsing import parse_rule_file
-from replacer import replace_matches
-from rule_ast import rule_node
-
-
-def apply_rule(rule: rule_node, word: str) -> str:
-    new_word = word
-    for change in rule.changes:
-        naive_matches = match_change(change, word)
-        matches = []
-        for match in naive_matches:
-            # successfully match if none of the negative environments match, and
-            # there are no positive environments, or
-            # one of the positive environments matches 
-            if all(environment_works(env, word, match) for env in rule.negative_environments) \
-                        and (not rule.positive_environments \
-                        or any(environment_works(env, word, match) for env in rule.positive_environments)):
-                matches.append(match)
-        if matches: 
-            new_word = replace_matches(new_word, matches, change)
-    return new_word
-
-
-def apply_rules(rule_list: list[rule_node], word_list: list[str]) -> list[str]:
-    # iterate in this order, applying each rule to every word before moving on,
-    # to keep open possibilities for pausing or halting execution at certain "times"
-    # within a rule list
-    for rule in rule_list:
-        for idx, word in enumerate(word_list):
-            word_list[idx] = apply_rule(rule, word)
-    return word_list
-
-
-def load_lexicon(lex_file: TextIOWrapper):
-    return [word for word in [line.strip() for line in lex_file]]
-
-
-def change_sounds(lex_file: TextIOWrapper, rule_file: TextIOWrapper) -> list[str]:
-    lexicon = load_lexicon(lex_file)
-    rule_list = parse_rule_file(rule_file)
-    return apply_rules(rule_list, lexicon)
-
-
-def write_output(word_list: list[str], out_file: TextIOWrapper):
-    # if there are any words to record, write to the output
-    # otherwise don't mess with the output file to avoid
-    # erasing anything when not needed
-    if word_list:
-        if not out_file:
-            # no r+ this time since we already know we want to overwrite this one
-            out_file = open("./changed_words", "w", encoding = "utf-8")
-        else:
-            # clear anything already in an existing file passed in from the command line
-            out_file.truncate(0)
 
-        out_file.write("\n".join(word for word in word_list))
 
+# the library half of this module (applying rules, reading and writing lexicons) lives in applier
+# its names are still available from here, but only imported on first use, so that the command line
+# (--help and argument errors especially) doesn't pay for regex, multipledispatch and so on before it needs them
+_applier_names = {"apply_rule", "apply_rules", "load_lexicon", "change_sounds", "write_output"}
 
+def __getattr__(name: str):
+    if name in _applier_names:
+        import applier
+        return getattr(applier, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-if __name__ == '__main__':
 
+# kept here rather than taken from output_formats to keep it out of argument parsing
+_output_format_names = ("plain", "pairs", "changed", "binary")
+
+
+def _line_range(range_str: str) -> tuple[int, int | None]:
+    from lexicon_index import parse_line_range
+    return parse_line_range(range_str)
+
+# argparse names the type in its error messages
+_line_range.__name__ = "line range"
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
 
     parser.add_argument("lex_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
@@ -77,17 +41,142 @@ if __name__ == '__main__':
     parser.add_argument("-o", "--out", action = "store", type = argparse.FileType("a", encoding = "utf-8"),\
         dest = "out_file", default = None)
     parser.add_argument("--time", action = "store_true")
-
-    args = parser.parse_args()
+    # the lexicon is memory-mapped when only some of its lines are wanted, so the rest is never read
+    parser.add_argument("--lines", action = "store", type = _line_range, default = None,
+        help = "only change the words on lines START:STOP (0-based, either end may be left off)")
+    parser.add_argument("--index", action = "store_true",
+        help = "save the lexicon's line index next to it, so later --lines runs start instantly")
+    parser.add_argument("--checkpoint-dir", action = "store", default = None,
+        help = "periodically save progress to this directory")
+    parser.add_argument("--checkpoint-interval", action = "store", type = float, default = 60.0,
+        help = "minimum number of seconds between checkpoints")
+    parser.add_argument("--resume", action = "store_true",
+        help = "continue from the last checkpoint in --checkpoint-dir, if it matches these inputs")
+    parser.add_argument("--progress", action = "store_true",
+        help = "print progress and an ETA after each rule")
+    parser.add_argument("--engine", action = "store", choices = ("interpreter", "compiled", "bulk", "shared"), default = "interpreter",
+        help = "compiled: compile rules with finite targets and environments into match tables, "
+               "interpreting only the rest; bulk: keep the lexicon as one string and apply each rule that "
+               "compiles to a single pattern to all of it at once, and the rest word by word; shared: store the lexicon "
+               "as shared prefixes and suffixes, and apply each rule to a shared prefix once for all the words starting with it")
+    parser.add_argument("--stages", action = "store", type = int, default = 0,
+        help = "split the rules into this many stages, each run in its own process, with words streaming between them")
+    parser.add_argument("--metrics", action = "store", default = None, metavar = "FILE",
+        help = "record time, memory and throughput for each phase of the run and write them to FILE")
+    parser.add_argument("--metrics-format", action = "store", choices = ("json", "prometheus"), default = None,
+        help = "defaults to prometheus text for a FILE ending in .prom, json otherwise")
+    parser.add_argument("--no-trace-allocations", action = "store_false", dest = "trace_allocations",
+        help = "leave allocations out of --metrics, which otherwise slows the run down several times over")
+    parser.add_argument("--work-limit", action = "store", type = int, default = None, metavar = "STEPS",
+        help = "stop with an error naming the rule and word if matching a rule in a single word takes more steps than this")
+    parser.add_argument("--watch", action = "store_true",
+        help = "keep running, and change the lexicon again whenever it or the rules file is saved")
+    parser.add_argument("--format", action = "store", choices = _output_format_names, default = "plain",
+        help = "plain: changed words; pairs: input<tab>output for every word; "
+               "changed: line<tab>input<tab>output for changed words only; binary: compact changed words only")
+
+    return parser
+
+
+def main(argv: list[str] = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
 
     if args.time:
         start_time = time()
 
-    word_list = change_sounds(args.rule_file, args.lex_file)
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint-dir")
+
+    if args.stages and args.engine not in ("interpreter", "compiled"):
+        parser.error("--stages only works with the interpreter and compiled engines")
+
+    # only these run one rule at a time over a list of words, so only they have anywhere to report progress from
+    if (args.checkpoint_dir or args.progress) and (args.stages or args.engine not in ("interpreter", "compiled")):
+        parser.error("--checkpoint-dir and --progress only work with the interpreter and compiled engines, without --stages")
+
+    if args.work_limit and (args.stages or args.engine not in ("interpreter", "compiled")):
+        parser.error("--work-limit only works with the interpreter and compiled engines, without --stages")
+
+    if args.watch:
+        if args.lines or args.checkpoint_dir or args.stages or args.metrics or args.work_limit \
+                or args.engine != "interpreter":
+            parser.error("--watch can only be combined with --out and --format")
+        from watch import watcher
+        watcher(args.lex_file.name, args.rules_file.name, args.out_file, args.format).run()
+        return
 
-    write_output(word_list)
+    # everything past here actually does work, so now is the time to import what it needs
+    from io import StringIO
+
+    from applier import apply_rules, load_lexicon, write_output
+    from checkpoint import checkpointer, progress_monitor, run_digest
+    from metrics import measure, run_metrics
+    from parsing import parse_rule_file
+
+    metrics = run_metrics(args.trace_allocations) if args.metrics else None
+
+    with measure(metrics, "loading"):
+        if args.lines or args.index:
+            from lexicon_index import mapped_lexicon
+            start, stop = args.lines or (0, None)
+            with mapped_lexicon(args.lex_file.name, persist_index = args.index) as lexicon:
+                word_list = list(lexicon.words(start, stop))
+        else:
+            word_list = load_lexicon(args.lex_file)
+
+    # the other formats need the unchanged words to compare against
+    original_words = list(word_list) if args.format != "plain" else None
+
+    rules_text = args.rules_file.read()
+    rule_list = parse_rule_file(StringIO(rules_text), metrics)
+
+    checkpoints = None
+    start_rule = 0
+    if args.checkpoint_dir:
+        checkpoints = checkpointer(args.checkpoint_dir, run_digest(rules_text, word_list))
+        if args.resume and (saved := checkpoints.load()):
+            start_rule, word_list = saved
+            print(f"Resuming after rule {start_rule}", file = sys.stderr)
+
+    on_rule_done = None
+    if checkpoints or args.progress:
+        on_rule_done = progress_monitor(len(rule_list), len(word_list), start_rule, checkpoints,
+            args.checkpoint_interval, out = sys.stderr if args.progress else None)
+
+    with measure(metrics, "applying"):
+        if args.stages:
+            from pipeline import run_pipeline
+            word_list = list(run_pipeline(rule_list[start_rule:], word_list, args.stages, engine = args.engine))
+        elif args.engine == "bulk":
+            from bulk import apply_bulk, compile_bulk
+            word_list = apply_bulk(compile_bulk(rule_list[start_rule:]), word_list)
+        elif args.engine == "shared":
+            from shared_lexicon import apply_rules_shared
+            word_list = apply_rules_shared(rule_list[start_rule:], word_list)
+        elif args.engine == "compiled":
+            from transducer import apply_compiled, compile_rules
+            word_list = apply_compiled(compile_rules(rule_list), word_list, start_rule, on_rule_done, metrics,
+                                       args.work_limit)
+        else:
+            word_list = apply_rules(rule_list, word_list, start_rule, on_rule_done, metrics, args.work_limit)
+
+    with measure(metrics, "writing"):
+        write_output(word_list, args.out_file, original_words, args.format, args.lines[0] if args.lines else 0)
+
+    if metrics:
+        metrics.stop()
+        metrics.write(args.metrics, args.metrics_format)
 
     if args.time:
         run_time = time() - start_time # type: ignore
         print("Execution time: " + str(run_time))
 
+    # the run finished, so there's nothing left to resume
+    if checkpoints:
+        checkpoints.clear()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+
+from pathlib import Path
+
+import pytest
+
+import batch
+from batch import batch_job, run_batch
+
+test_folder = Path("./test")
+
+
+def _fixture_jobs(out_dir: Path) -> list[batch_job]:
+    return [batch_job(sub_dir/"lex", sub_dir/"rules", out_dir/sub_dir.name)
+            for sub_dir in sorted(test_folder.iterdir()) if (sub_dir/"expected_output").is_file()]
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_fixtures(tmp_path, processes):
+    jobs = _fixture_jobs(tmp_path)
+    results = run_batch(jobs, max_concurrent = 2, processes = processes)
+
+    assert [result.job for result in results] == jobs
+    for result in results:
+        assert result.ok, result.error
+        expected = (result.job.lex_path.parent/"expected_output").read_bytes()
+        assert result.job.out_path.read_bytes() == expected
+
+
+def test_shared_rules_parsed_once(tmp_path, monkeypatch):
+    parsed = []
+    read_rules = batch._read_rules
+    def counting_read_rules(path):
+        parsed.append(path)
+        return read_rules(path)
+    monkeypatch.setattr(batch, "_read_rules", counting_read_rules)
+
+    fixture = test_folder/"sound_classes"
+    jobs = [batch_job(fixture/"lex", fixture/"rules", tmp_path/f"out{idx}") for idx in range(5)]
+    results = run_batch(jobs, max_concurrent = 5)
+
+    assert all(result.ok for result in results)
+    assert len(parsed) == 1
+    expected = (fixture/"expected_output").read_bytes()
+    assert all(job.out_path.read_bytes() == expected for job in jobs)
+
+
+def test_failing_job_is_isolated(tmp_path):
+    bad_rules = tmp_path/"bad_rules"
+    bad_rules.write_text("classes:\nnot a class\nrules:\na > e\n", encoding = "utf-8")
+    fixture = test_folder/"basic_replacements"
+    jobs = [
+        batch_job(fixture/"lex", fixture/"rules", tmp_path/"before"),
+        batch_job(fixture/"lex", bad_rules, tmp_path/"bad"),
+        batch_job(tmp_path/"missing_lex", fixture/"rules", tmp_path/"missing"),
+        batch_job(fixture/"lex", fixture/"rules", tmp_path/"after"),
+    ]
+    results = run_batch(jobs, max_concurrent = 4)
+
+    assert [result.ok for result in results] == [True, False, False, True]
+    assert "parse_error" in results[1].error
+    assert "FileNotFoundError" in results[2].error
+    expected = (fixture/"expected_output").read_bytes()
+    assert (tmp_path/"before").read_bytes() == expected
+    assert (tmp_path/"after").read_bytes() == expected
+    assert not (tmp_path/"bad").exists() and not (tmp_path/"missing").exists()
@@ -0,0 +1,81 @@
+
+from pathlib import Path
+
+from applier import apply_rules, load_lexicon
+from checkpoint import checkpointer, progress_monitor, run_digest
+from parsing import parse_rule_file
+from sound_changer import main
+
+fixture = Path("./test/sound_classes")
+
+
+def test_round_trip(tmp_path):
+    checkpoints = checkpointer(tmp_path, run_digest("rules:", ["a", "b"]))
+    assert checkpoints.load() is None
+    checkpoints.save(3, ["pa", "", "ta"])
+    assert checkpoints.load() == (3, ["pa", "", "ta"])
+    checkpoints.clear()
+    assert checkpoints.load() is None
+
+
+def test_empty_lexicon(tmp_path):
+    checkpoints = checkpointer(tmp_path, run_digest("rules:", []))
+    checkpoints.save(1, [])
+    assert checkpoints.load() == (1, [])
+
+
+def test_other_run_is_ignored(tmp_path):
+    checkpointer(tmp_path, run_digest("rules:", ["a"])).save(1, ["e"])
+    assert checkpointer(tmp_path, run_digest("rules:", ["b"])).load() is None
+
+
+def test_truncated(tmp_path):
+    checkpoints = checkpointer(tmp_path, "digest")
+    checkpoints.save(2, ["pa", "ta", "ka"])
+    text = checkpoints.path.read_text(encoding = "utf-8")
+
+    # words missing from the end
+    checkpoints.path.write_text(text[:-3], encoding = "utf-8")
+    assert checkpoints.load() is None
+    # cut off partway through the header
+    checkpoints.path.write_text(text[:20], encoding = "utf-8")
+    assert checkpoints.load() is None
+
+
+def test_progress_report():
+    monitor = progress_monitor(rule_count = 4, word_count = 100, start_rule = 1, out = None)
+    # 2 rules over 100 words in 4s, with 1 more rule to go
+    report = monitor.report(3, monitor.start_time + 4.0)
+    assert report == "rule 3/4, 200 rule applications in 4.0s (50 rule applications/s), ETA 2.0s"
+
+
+def test_resume_matches_uninterrupted_run(tmp_path, capsys):
+    lex_path, rules_path = fixture/"lex", fixture/"rules"
+    uninterrupted = tmp_path/"uninterrupted"
+    main([str(lex_path), str(rules_path), "-o", str(uninterrupted)])
+
+    # a checkpoint as a run killed after the first rule would have left it
+    rules_text = rules_path.read_text(encoding = "utf-8")
+    with open(lex_path, "r", encoding = "utf-8") as lex_file:
+        word_list = load_lexicon(lex_file)
+    with open(rules_path, "r", encoding = "utf-8") as rules_file:
+        rule_list = parse_rule_file(rules_file)
+    checkpoint_dir = tmp_path/"checkpoints"
+    checkpointer(checkpoint_dir, run_digest(rules_text, word_list)).save(1, apply_rules(rule_list[:1], list(word_list)))
+
+    resumed = tmp_path/"resumed"
+    main([str(lex_path), str(rules_path), "-o", str(resumed), "--checkpoint-dir", str(checkpoint_dir), "--resume"])
+
+    assert "Resuming after rule 1" in capsys.readouterr().err
+    assert resumed.read_bytes() == uninterrupted.read_bytes()
+    # a finished run leaves nothing to resume
+    assert not (checkpoint_dir/"checkpoint").exists()
+
+
+def test_compiled_engine_reports_every_rule(tmp_path, capsys):
+    # basic_replacements compiles into a single cascade, which is still run and reported a rule at a time
+    fixture_dir = Path("./test/basic_replacements")
+    main([str(fixture_dir/"lex"), str(fixture_dir/"rules"), "-o", str(tmp_path/"out"), "--engine", "compiled", "--progress"])
+    reports = [line.split(",")[0] for line in capsys.readouterr().err.splitlines()]
+    assert reports == ["rule 1/4", "rule 2/4", "rule 3/4", "rule 4/4"]
+    assert (tmp_path/"out").read_text(encoding = "utf-8") == (fixture_dir/"expected_output").read_text(encoding = "utf-8")
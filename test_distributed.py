@@ -0,0 +1,168 @@
+
+import socket
+import threading
+from io import StringIO
+from pathlib import Path
+from time import sleep
+
+import distributed
+from applier import apply_rules, load_lexicon, write_output
+from distributed import coordinator, receive_message, run_worker, send_message
+from lexicon_index import mapped_lexicon
+from parsing import parse_rule_file
+
+test_folder = Path("./test")
+
+
+def _dying_worker(host: str, port: int, took_shard: threading.Event):
+    "Takes a shard and disconnects without answering."
+    with socket.create_connection((host, port)) as sock:
+        send_message(sock, {"type": "hello"})
+        receive_message(sock)
+        send_message(sock, {"type": "ready"})
+        assert receive_message(sock)["type"] == "shard"
+    took_shard.set()
+
+
+def _confused_worker(host: str, port: int, took_shard: threading.Event):
+    "Takes a shard and answers with something that isn't a result."
+    with socket.create_connection((host, port)) as sock:
+        send_message(sock, {"type": "hello"})
+        receive_message(sock)
+        send_message(sock, {"type": "ready"})
+        assert receive_message(sock)["type"] == "shard"
+        send_message(sock, {"kind": "nonsense"})
+        took_shard.set()
+        # the coordinator hangs up on it
+        try:
+            receive_message(sock)
+        except ConnectionError:
+            pass
+
+
+def _start_after(event: threading.Event, target, *args):
+    # the coordinator only accepts connections once it's running, so waiting has to happen off the main thread
+    event.wait(timeout = 30)
+    target(*args)
+
+
+def _output(word_list) -> str:
+    out = StringIO()
+    write_output(word_list, out)
+    return out.getvalue()
+
+
+def test_loopback_matches_serial():
+    for sub_dir in test_folder.iterdir():
+        with open(sub_dir/"lex", "r", encoding = "utf-8") as lex_file:
+            word_list = load_lexicon(lex_file)
+        rules_text = (sub_dir/"rules").read_text(encoding = "utf-8")
+        expected = _output(apply_rules(parse_rule_file(StringIO(rules_text)), list(word_list)))
+
+        coord = coordinator(rules_text, word_list, shard_size = 1)
+        host, port = coord.address
+        took_shard = threading.Event()
+        dying = threading.Thread(target = _dying_worker, args = (host, port, took_shard))
+        workers = [threading.Thread(target = run_worker, args = (host, port)) for _ in range(3)]
+
+        def start_workers():
+            # only once a shard has been lost, so that it's certain to have to be handed out again
+            took_shard.wait()
+            for worker in workers:
+                worker.start()
+        starter = threading.Thread(target = start_workers)
+        dying.start()
+        starter.start()
+
+        assert _output(coord.run(timeout = 30)) == expected
+        starter.join()
+        for worker in workers:
+            worker.join(timeout = 30)
+
+
+def test_malformed_reply_is_handed_out_again():
+    coord = coordinator("rules:\na > e\n", ["pa", "ta", "ka"], shard_size = 1)
+    host, port = coord.address
+    took_shard = threading.Event()
+    confused = threading.Thread(target = _confused_worker, args = (host, port, took_shard))
+    worker = threading.Thread(target = _start_after, args = (took_shard, run_worker, host, port))
+    confused.start()
+    worker.start()
+
+    assert coord.run(timeout = 30) == ["pe", "te", "ke"]
+    confused.join(timeout = 30)
+    worker.join(timeout = 30)
+
+
+def test_mapped_lexicon_is_sharded_by_line_range(tmp_path):
+    lex_path = tmp_path/"lex"
+    lex_path.write_bytes("pa\nta\n\nkʰa\nma".encode("utf-8"))
+    with mapped_lexicon(lex_path, index_path = tmp_path/"lex.idx") as lexicon:
+        coord = coordinator("rules:\na > e\n", lexicon, shard_size = 2)
+        assert coord.shards == [(0, 2), (2, 4), (4, 5)]
+        host, port = coord.address
+        worker = threading.Thread(target = run_worker, args = (host, port))
+        worker.start()
+        assert coord.run(timeout = 30) == ["pe", "te", "", "kʰe", "me"]
+        worker.join(timeout = 30)
+
+
+def test_slow_shard_is_handed_out_again(monkeypatch):
+    slow_started = threading.Event()
+
+    def rule_function(rules_text, engine):
+        rule_list = parse_rule_file(StringIO(rules_text))
+        def apply(words):
+            # only the very first shard is slow
+            if not slow_started.is_set():
+                slow_started.set()
+                sleep(1)
+            return apply_rules(rule_list, words)
+        return apply
+    monkeypatch.setattr(distributed, "_rule_function", rule_function)
+
+    coord = coordinator("rules:\na > e\n", ["pa", "ta", "ka", "ma"], shard_size = 1, shard_timeout = 0.2)
+    host, port = coord.address
+    slow_shards = []
+    slow = threading.Thread(target = lambda: slow_shards.append(run_worker(host, port)))
+    worker = threading.Thread(target = _start_after, args = (slow_started, run_worker, host, port))
+    slow.start()
+    worker.start()
+
+    assert coord.run(timeout = 30) == ["pe", "te", "ke", "me"]
+    worker.join(timeout = 30)
+    # the slow worker finds itself disconnected once it's done, and stops without an error
+    slow.join(timeout = 30)
+    assert slow_shards == [1]
+
+
+def test_oversized_message_is_refused():
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        # a length alone, claiming far more than the limit, with nothing after it
+        sender.sendall(distributed._length.pack(distributed.max_message_size + 1))
+        try:
+            receive_message(receiver)
+        except ConnectionError as error:
+            assert "over the limit" in str(error)
+        else:
+            assert False, "an oversized message was read"
+
+
+def test_worker_without_token_gets_nothing():
+    coord = coordinator("rules:\na > e\n", ["pa", "ta", "ka"], shard_size = 1, token = "secret")
+    host, port = coord.address
+    turned_away = threading.Event()
+    intruder_shards = []
+
+    def intruder():
+        intruder_shards.append(run_worker(host, port, token = "guess"))
+        turned_away.set()
+    # the real worker only starts once the intruder has been hung up on, so that it can't take every shard first
+    worker = threading.Thread(target = _start_after, args = (turned_away, run_worker, host, port, 10.0, "secret"))
+    threading.Thread(target = intruder).start()
+    worker.start()
+
+    assert coord.run(timeout = 30) == ["pe", "te", "ke"]
+    worker.join(timeout = 30)
+    assert intruder_shards == [0]
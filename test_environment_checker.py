@@ -0,0 +1,42 @@
+
+import random
+from io import StringIO
+
+from applier import apply_rule
+from matcher import environment_checker
+from parsing import parse_rule_file
+
+
+_rules = """classes:
+C=ptkmns
+V=aeio
+rules:
+a > e /! _C /! x(C)(V)_ / p_ / _(V)t / V_
+o > u / _V /! k_ / C_C /! _x
+i > 0 / V_ /! _p /! t_ / _s
+(C)k > g /! a_ / _V /! _(C)i
+"""
+
+
+def test_reordered_checks_agree(monkeypatch):
+    # reorder (and time) often enough for a few hundred words to go through many reorderings
+    monkeypatch.setattr(environment_checker, "reorder_interval", 8)
+    monkeypatch.setattr(environment_checker, "timing_interval", 2)
+
+    rng = random.Random(0)
+    words = ["".join(rng.choice("aeioptkmnsx") for _ in range(rng.randint(1, 10))) for _ in range(500)]
+    for rule in parse_rule_file(StringIO(_rules)):
+        checker = environment_checker(rule.negative_environments, rule.positive_environments)
+        for word in words:
+            assert apply_rule(rule, word, checker) == apply_rule(rule, word), (rule.source, word)
+        assert checker.evaluations > environment_checker.reorder_interval
+
+    # for the first rule, "/! _C" settles most matches, so it should end up checked first
+    rule = parse_rule_file(StringIO(_rules))[0]
+    checker = environment_checker(rule.negative_environments, rule.positive_environments)
+    decisive = next(idx for idx, (env, is_positive) in enumerate(checker.checks)
+                    if not is_positive and env.post_expression.elements)
+    assert checker.order[0] != decisive
+    for word in words:
+        apply_rule(rule, word, checker)
+    assert checker.order[0] == decisive
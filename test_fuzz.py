@@ -0,0 +1,29 @@
+
+from dataclasses import replace
+
+from fuzz import fuzz, known_engines, reference_engine
+
+
+def _ignore_environments(rule_list, word_list):
+    rule_list = [replace(rule, positive_environments = [], negative_environments = []) for rule in rule_list]
+    return reference_engine(rule_list, word_list)
+
+
+def test_reference_agrees_with_itself():
+    report = fuzz(reference_engine, cases = 200, seed = 0)
+    assert report.cases_run > 150
+    assert not report.failures
+
+
+def test_finds_and_shrinks_mismatch():
+    report = fuzz(_ignore_environments, cases = 500, seed = 0)
+    assert len(report.failures) == 1
+    case = report.failures[0].case
+    assert len(case.rules) == 1 and len(case.words) == 1
+    assert "/" in case.rules[0]
+
+
+def test_known_engines():
+    for name, engine in known_engines().items():
+        report = fuzz(engine, cases = 300, seed = 0)
+        assert not report.failures, f"{name} disagrees with the reference:\n{report}"
@@ -0,0 +1,66 @@
+
+from pathlib import Path
+
+import pytest
+
+from lexicon_index import mapped_lexicon, parse_line_range
+from sound_changer import load_lexicon, main
+
+test_folder = Path("./test")
+
+
+def test_matches_load_lexicon(tmp_path):
+    for lex_path in test_folder.glob("*/lex"):
+        with open(lex_path, "r", encoding = "utf-8") as lex_file:
+            expected = load_lexicon(lex_file)
+        with mapped_lexicon(lex_path, index_path = tmp_path/"lex.idx") as lexicon:
+            assert list(lexicon) == expected
+            assert lexicon[1:4] == expected[1:4]
+            assert lexicon[-1] == expected[-1]
+
+
+def test_persisted_index(tmp_path):
+    lex_path = tmp_path/"lex"
+    lex_path.write_text("ta\r\nkʰa\n\nsta", encoding = "utf-8")
+
+    with mapped_lexicon(lex_path, persist_index = True) as lexicon:
+        assert list(lexicon) == ["ta", "kʰa", "", "sta"]
+
+    with mapped_lexicon(lex_path) as lexicon:
+        assert lexicon._load_index() is not None
+        assert list(lexicon.words(2)) == ["", "sta"]
+
+
+def test_empty_lexicon(tmp_path):
+    lex_path = tmp_path/"lex"
+    lex_path.write_bytes(b"")
+    with mapped_lexicon(lex_path) as lexicon:
+        assert len(lexicon) == 0
+
+
+def test_line_endings(tmp_path):
+    lex_path = tmp_path/"lex"
+    # every ending text mode knows, including lone carriage returns and a blank line between two of them
+    lex_path.write_bytes("ta\rkʰa\r\rsta\r\npi\n\r\nmu\r".encode("utf-8"))
+    with open(lex_path, "r", encoding = "utf-8") as lex_file:
+        expected = load_lexicon(lex_file)
+    with mapped_lexicon(lex_path, index_path = tmp_path/"lex.idx") as lexicon:
+        assert list(lexicon) == expected == ["ta", "kʰa", "", "sta", "pi", "", "mu"]
+
+
+def test_line_ranges(tmp_path):
+    assert parse_line_range("1:3") == (1, 3)
+    assert parse_line_range(":3") == (0, 3)
+    assert parse_line_range("2:") == (2, None)
+    for range_str in ("-2:", "1:-1", ":-1", "1-3"):
+        with pytest.raises(ValueError):
+            parse_line_range(range_str)
+
+    # the command line turns them into usage errors, without writing anything
+    out_path = tmp_path/"out"
+    for range_str in ("-2:", "1:-1"):
+        with pytest.raises(SystemExit):
+            main(["test/basic_replacements/lex", "test/basic_replacements/rules", "-o", str(out_path),
+                  f"--lines={range_str}"])
+    # argparse opens (and so creates) the output file before getting to --lines
+    assert out_path.read_text(encoding = "utf-8") == ""
@@ -0,0 +1,40 @@
+
+from dataclasses import replace
+from io import StringIO
+
+import pytest
+
+from applier import apply_rule, apply_rules
+from fuzz import fuzz
+from matcher import work_limit_error
+from parsing import parse_rule_file
+
+
+# 2^16 * 2 ways of trying to match at every position where nothing matches
+_explosive_rules = "rules:\n" + "(a)" * 16 + "{b,c} > x\n"
+
+
+def _memoized_engine(rule_list, word_list):
+    return apply_rules([replace(rule, memoize = True) for rule in rule_list], word_list)
+
+
+def test_explosive_rule_is_memoized():
+    with pytest.warns(UserWarning, match = "131072 ways"):
+        rule, = parse_rule_file(StringIO(_explosive_rules))
+    assert rule.memoize
+    # far too slow to finish without memoizing
+    assert apply_rule(rule, "a" * 40) == "a" * 40
+    assert apply_rule(rule, "a" * 40 + "c") == "a" * 24 + "x"
+
+
+def test_memoized_matches_agree():
+    report = fuzz(_memoized_engine, cases = 300, seed = 0)
+    assert not report.failures, str(report)
+
+
+def test_work_limit_names_rule():
+    with pytest.warns(UserWarning):
+        rule, = parse_rule_file(StringIO(_explosive_rules))
+    with pytest.raises(work_limit_error, match = r"\(a\)\{b,c\}") as error:
+        apply_rules([replace(rule, memoize = False)], ["a" * 40], work_limit = 10_000)
+    assert '"' + "a" * 40 + '"' in str(error.value)
@@ -0,0 +1,35 @@
+
+import json
+from io import StringIO
+from pathlib import Path
+
+from applier import change_sounds
+from metrics import run_metrics
+
+test_folder = Path("./test")
+
+
+def test_metrics():
+    sub_dir = next(test_folder.iterdir())
+    metrics = run_metrics()
+    with open(sub_dir/"lex", "r", encoding = "utf-8") as lex_file, \
+            open(sub_dir/"rules", "r", encoding = "utf-8") as rule_file:
+        word_list = change_sounds(lex_file, rule_file, metrics)
+    metrics.stop()
+
+    assert set(metrics.phases) == {"loading", "class_parsing", "tokenizing", "parse_tokens", "applying"}
+    rule_count = metrics.phases["tokenizing"].calls
+    assert metrics.phases["parse_tokens"].calls == rule_count
+    assert [sample.rules_done for sample in metrics.samples] == list(range(1, rule_count + 1))
+    assert all(sample.words == len(word_list) for sample in metrics.samples)
+
+    snapshot = json.loads(json.dumps(metrics.to_dict()))
+    assert snapshot["peak_rss_bytes"] > 0
+
+    out = StringIO()
+    metrics.write_prometheus(out)
+    lines = [line for line in out.getvalue().splitlines() if not line.startswith("#")]
+    assert 'sound_changer_phase_calls{phase="applying"} 1' in lines
+    for line in lines:
+        _, value = line.rsplit(" ", 1)
+        float(value)
@@ -0,0 +1,49 @@
+
+from io import BytesIO, StringIO
+
+from output_formats import read_binary_output, write_binary, write_changed, write_pairs, write_plain
+
+
+_original = ["pata", "kita", "sunu", "maka", "tenu"]
+_changed = ["pada", "kita", "sunu", "maga", "tenü"]
+
+
+def test_plain():
+    out = StringIO()
+    write_plain(out, _changed)
+    assert out.getvalue() == "pada\nkita\nsunu\nmaga\ntenü"
+
+
+def test_pairs():
+    out = StringIO()
+    write_pairs(out, _changed, _original)
+    assert out.getvalue() == "pata\tpada\nkita\tkita\nsunu\tsunu\nmaka\tmaga\ntenu\ttenü"
+
+
+def test_changed():
+    out = StringIO()
+    write_changed(out, _changed, _original)
+    assert out.getvalue() == "0\tpata\tpada\n3\tmaka\tmaga\n4\ttenu\ttenü"
+
+    out = StringIO()
+    write_changed(out, _changed[2:], _original[2:], first_line = 2)
+    assert out.getvalue() == "3\tmaka\tmaga\n4\ttenu\ttenü"
+
+
+def test_binary_round_trip():
+    out = BytesIO()
+    write_binary(out, _changed, _original)
+    assert read_binary_output(out.getvalue(), _original) == _changed
+
+
+def test_binary_round_trip_with_first_line():
+    # as if run with --lines 2:4, so only those lines change, in place in the whole lexicon
+    out = BytesIO()
+    write_binary(out, _changed[2:4], _original[2:4], first_line = 2)
+    assert read_binary_output(out.getvalue(), _original) == _original[:3] + ["maga"] + _original[4:]
+
+
+def test_binary_unchanged():
+    out = BytesIO()
+    write_binary(out, _original, _original)
+    assert read_binary_output(out.getvalue(), _original) == _original
@@ -0,0 +1,27 @@
+
+from pathlib import Path
+
+from applier import apply_rules, load_lexicon
+from parsing import parse_rule_file
+from pipeline import run_pipeline, split_stages
+
+test_folder = Path("./test")
+
+
+def test_split_stages():
+    assert split_stages([], 3) == []
+    assert split_stages([1.0, 1.0, 1.0, 1.0], 2) == [(0, 2), (2, 4)]
+    assert split_stages([5.0, 1.0, 1.0, 1.0, 1.0, 1.0], 2) == [(0, 1), (1, 6)]
+    # never more stages than rules
+    assert split_stages([1.0, 2.0], 8) == [(0, 1), (1, 2)]
+
+
+def test_matches_serial():
+    for sub_dir in test_folder.iterdir():
+        with open(sub_dir/"lex", "r", encoding = "utf-8") as lex_file:
+            word_list = load_lexicon(lex_file)
+        with open(sub_dir/"rules", "r", encoding = "utf-8") as rule_file:
+            rule_list = parse_rule_file(rule_file)
+
+        expected = apply_rules(rule_list, list(word_list))
+        assert list(run_pipeline(rule_list, word_list, stage_count = 2, batch_size = 3, queue_size = 1)) == expected
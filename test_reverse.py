@@ -0,0 +1,48 @@
+
+from io import StringIO
+
+import pytest
+
+from applier import apply_rules
+from parsing import parse_rule_file
+from reverse import reverse_lexicon
+
+rules_text = """
+classes:
+V=a,e,i,o,u
+P=p,t,k
+B=b,d,g
+rules:
+P > B / V_V
+o > u
+s > 0 / V_t
+a > e / _i
+"""
+
+words = ["apa", "tokos", "kasta", "aip", "ostota"]
+
+
+def test_reverse():
+    rule_list = parse_rule_file(StringIO(rules_text))
+    changed = apply_rules(rule_list, list(words))
+
+    results = reverse_lexicon(rule_list, changed, beam_width = 32)
+    for word, descendant, reconstructions in zip(words, changed, results):
+        assert word in [r.word for r in reconstructions]
+        # every proposal really does turn into the attested word
+        for r in reconstructions:
+            assert apply_rules(rule_list, [r.word]) == [descendant]
+
+    # a proto-lexicon limits proposals to its own words
+    results = reverse_lexicon(rule_list, changed, proto_lexicon = words)
+    assert [[r.word for r in reconstructions] for reconstructions in results] == [[word] for word in words]
+
+
+def test_reverse_rule_that_cant_be_inverted():
+    # C is too big to expand, so CCC > a can't be inverted; candidates it would change must still be dropped
+    rule_list = parse_rule_file(StringIO("classes:\nC=b,c,d,f,g,h,j,k,l,z\nrules:\nCCC > a\nz > b\n"))
+    with pytest.warns(UserWarning, match = "Line"):
+        results = reverse_lexicon(rule_list, ["bbbb", "bab"])
+    # zbbb and bbbz would be proposed for bbbb if CCC > a were skipped, but turn into ab and ba
+    assert results[0] == []
+    assert sorted(r.word for r in results[1]) == ["bab", "baz", "zab", "zaz"]
@@ -0,0 +1,43 @@
+
+import random
+from io import StringIO
+
+from applier import apply_rules
+from parsing import parse_rule_file
+from shared_lexicon import apply_rules_shared, shared_lexicon
+
+
+# th before t in C, so matching t has to rule out th (a class exclusion); post-environments of one and two sounds
+_rules = """classes:
+C=th,t,s,k,n
+G=dh,d,z,g,m
+V=a,e,i,o
+rules:
+C > G / V_V
+{t,k} > h / _{a,e}i
+ae > e / _s
+o > u /! _n
+Ci > Cj / _V
+s > 0 / _th
+i > e /! _V
+"""
+
+_endings = ["", "a", "os", "ibus", "em", "is", "orum", "ae", "aeis", "at", "ant", "atha", "ando", "ion", "i", "ithe"]
+
+
+def test_paradigms_match_apply_rules():
+    rng = random.Random(0)
+    stems = ["".join(rng.choice(["th", "t", "s", "k", "n", "a", "e", "i", "o", "ae"]) for _ in range(rng.randint(2, 7)))
+             for _ in range(150)]
+    # every stem with every ending, so neighbouring words share long prefixes; and some words twice
+    words = [stem + ending for stem in stems for ending in _endings]
+    words += words[::7]
+    rng.shuffle(words)
+
+    rule_list = parse_rule_file(StringIO(_rules))
+    assert apply_rules_shared(rule_list, list(words)) == apply_rules(rule_list, list(words))
+
+    # stems and endings are each stored about once, rather than once per word
+    lexicon = shared_lexicon(words)
+    assert len(lexicon.prefixes) <= len(stems)
+    assert len(lexicon.prefixes) + len(lexicon.suffixes) < len(set(words)) // 2
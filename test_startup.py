@@ -0,0 +1,40 @@
+
+import subprocess
+import sys
+
+# the agreed ceiling on the cumulative import time of everything sound_changer.py --help pulls in
+# beyond the interpreter's own startup, in microseconds
+import_budget = 50_000
+
+# none of these should be imported just to parse arguments
+heavy_modules = {"regex", "multipledispatch", "ordered_set", "matcher", "parsing", "applier"}
+
+
+def _import_times(*args: str) -> tuple[dict[str, int], set[str]]:
+    """Runs python with -X importtime and returns each top-level import's cumulative time,
+    along with the names of every module imported at all."""
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output = True, text = True)
+    times = {}
+    names = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        names.add(name.strip())
+        # nested imports are indented, and are already counted in their importer's cumulative time
+        if not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times, names
+
+
+def test_help_import_budget():
+    baseline, _ = _import_times("-c", "pass")
+    times, names = _import_times("sound_changer.py", "--help")
+
+    assert not heavy_modules & names
+
+    imported = set(times) - set(baseline)
+    assert "argparse" in imported
+
+    total = sum(times[name] for name in imported)
+    assert total < import_budget, f"sound_changer.py --help spent {total}us importing {sorted(imported)}"
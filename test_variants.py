@@ -0,0 +1,54 @@
+
+from io import StringIO
+
+from applier import apply_rules
+from parsing import parse_rule_file
+from variants import apply_rule_variants, build_variant_tree, count_rule_applications
+
+
+_rules = {"r1": "a > e", "r2": "e > i", "r3": "p > b", "r4": "t > d", "r5": "i > 0"}
+
+_variants = [
+    ["r1", "r2", "r3"],
+    # a prefix of the first
+    ["r1", "r2"],
+    # splits the first's run in the middle
+    ["r1", "r4", "r3"],
+    # identical to the first
+    ["r1", "r2", "r3"],
+    # an empty rule file
+    [],
+    # nothing in common with any other
+    ["r5"],
+]
+
+_words = ["pat", "tap", "pit", "epa", "kika", ""]
+
+
+def _parse(names: list[str]):
+    return parse_rule_file(StringIO("rules:\n" + "\n".join(_rules[name] for name in names) + "\n"))
+
+
+def test_variants_match_separate_runs():
+    rule_lists = [_parse(names) for names in _variants]
+    results = apply_rule_variants(rule_lists, list(_words))
+    assert results == [apply_rules(rule_list, list(_words)) for rule_list in rule_lists]
+
+
+def test_variant_tree():
+    root = build_variant_tree([_parse(names) for names in _variants])
+
+    assert root.variants == [4]
+    shared, unrelated = root.children
+    assert len(shared.rules) == 1 and shared.variants == []
+    assert unrelated.variants == [5]
+
+    # r2 then r3, and r4 then r3
+    through_r2, through_r4 = shared.children
+    assert len(through_r2.rules) == 1 and through_r2.variants == [1]
+    assert len(through_r4.rules) == 2 and through_r4.variants == [2]
+    ending_r3, = through_r2.children
+    assert ending_r3.variants == [0, 3]
+
+    # r1, r2, r3, r4 r3 and r5, rather than the 12 rules of every list run separately
+    assert count_rule_applications(root) == 6
@@ -0,0 +1,96 @@
+
+import os
+from io import StringIO
+
+from applier import apply_rules
+from parsing import parse_rule_file
+from watch import watcher
+
+rules_text = """
+classes:
+V=a,e,i,o,u
+P=p,t,k
+B=b,d,g
+rules:
+P > B / V_V
+o > u
+a > e / _i
+"""
+
+
+def _save(path, text):
+    path.write_text(text, encoding = "utf-8")
+    # make sure the change is seen even on filesystems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def _expected(rules, words):
+    return "\n".join(apply_rules(parse_rule_file(StringIO(rules)), list(words)))
+
+
+def test_watch(tmp_path):
+    lex_path, rules_path = tmp_path/"lex", tmp_path/"rules"
+    words = ["apa", "tokos", "aip", "ostota"]
+    _save(lex_path, "\n".join(words))
+    _save(rules_path, rules_text)
+
+    out, log = StringIO(), StringIO()
+    watch = watcher(str(lex_path), str(rules_path), out, log = log)
+    assert watch.refresh()
+    assert out.getvalue() == _expected(rules_text, words)
+    assert not watch.refresh()
+
+    # only the edited rule is parsed again, and only it and the rules after it are applied again
+    new_rules = rules_text.replace("o > u", "o > a")
+    _save(rules_path, new_rules)
+    assert watch.refresh()
+    assert watch.cache.reparsed == 1
+    assert "applied rules 2-3" in log.getvalue().splitlines()[-1]
+    assert out.getvalue() == _expected(new_rules, words)
+
+    # a changed class parses everything again
+    new_rules = new_rules.replace("B=b,d,g", "B=v,d,g")
+    _save(rules_path, new_rules)
+    watch.refresh()
+    assert watch.cache.reparsed == 3
+    assert out.getvalue() == _expected(new_rules, words)
+
+    # and a changed lexicon applies everything again
+    words.append("kapo")
+    _save(lex_path, "\n".join(words))
+    watch.refresh()
+    assert "applied rules 1-3" in log.getvalue().splitlines()[-1]
+    assert out.getvalue() == _expected(new_rules, words)
+
+
+def test_stdout_runs_are_separated(tmp_path, capsys):
+    lex_path, rules_path = tmp_path/"lex", tmp_path/"rules"
+    _save(lex_path, "pa\nta")
+    _save(rules_path, "rules:\na > e\n")
+
+    watch = watcher(str(lex_path), str(rules_path), log = StringIO())
+    watch.refresh()
+    _save(rules_path, "rules:\na > o\n")
+    watch.refresh()
+
+    first, second, rest = capsys.readouterr().out.split("\n" + "-" * 40 + "\n")
+    assert (first, second, rest) == ("pe\nte", "po\nto", "")
+
+
+def test_moved_rules_keep_line_numbers(tmp_path):
+    lex_path, rules_path = tmp_path/"lex", tmp_path/"rules"
+    _save(lex_path, "pa")
+    _save(rules_path, "rules:\na > e\no > u\n")
+
+    log = StringIO()
+    watch = watcher(str(lex_path), str(rules_path), StringIO(), log = log)
+    watch.refresh()
+    assert [rule.linenum for rule in watch.rule_list] == [0, 1]
+
+    # lines inserted above don't make the rules new, but do move them
+    _save(rules_path, "rules:\n# a comment\n\na > e\no > u\n")
+    watch.refresh()
+    assert watch.cache.reparsed == 0
+    assert [rule.linenum for rule in watch.rule_list] == [2, 3]
+    assert "no rules to apply again" in log.getvalue().splitlines()[-1]
@@ -0,0 +1,280 @@
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from itertools import product
+from typing import Callable, Optional
+
+from applier import apply_rule
+from matcher import _reverse_node, class_slot, match_data
+from metrics import run_metrics
+from replacer import replace_matches
+from rule_ast import rule_node
+from rule_ast_nodes import *
+
+
+# rules whose targets or environments would expand into more alternatives than this are left to the interpreter
+max_alternatives = 512
+
+
+@dataclass(frozen = True)
+class alternative:
+    """One way a finite expression can match: the exact string it consumes, the class slots it passes
+    through (for the replacer), and the class sounds that must *not* match at given offsets.
+
+    The last part mirrors _match(sound_class_node), which only ever tries the first sound in a class that matches:
+    taking the nth sound of a class is only possible where none of the sounds before it match."""
+    string: str
+    classes: tuple[class_slot, ...] = ()
+    exclusions: tuple[tuple[int, tuple[str, ...]], ...] = ()
+
+    def __add__(self, other: alternative) -> alternative:
+        offset = len(self.string)
+        shifted = tuple((pos + offset, sounds) for pos, sounds in other.exclusions)
+        return alternative(self.string + other.string, self.classes + other.classes, self.exclusions + shifted)
+
+    def matches(self, word: str, pos: int) -> bool:
+        if not word.startswith(self.string, pos):
+            return False
+        for offset, sounds in self.exclusions:
+            for sound in sounds:
+                if word.startswith(sound, pos + offset):
+                    return False
+        return True
+
+
+class not_finite(Exception):
+    "Raised while expanding an expression that can't be expanded to a (small enough) list of alternatives."
+
+
+def expand(node: ast_node) -> list[alternative]:
+    """Lists every way a node can match, in the same order _match would try them.
+    The first of these that matches at a position is exactly what get_first_match would find there."""
+    match node:
+        case sound_node(sound = s):
+            alternatives = [alternative(s)]
+        case sound_class_node(sound_class = c):
+            alternatives = [alternative(sound, (class_slot(c, idx),), ((0, tuple(c[:idx])),) if idx else ())
+                            for idx, sound in enumerate(c)]
+        case optional_node(expression = e):
+            alternatives = expand(e) + [alternative("")]
+        case sound_list_node(expressions = exprs):
+            alternatives = [alt for e in exprs for alt in expand(e)]
+        case expression_node(elements = elms):
+            alternatives = [alternative("")]
+            for element in elms:
+                element_alternatives = expand(element)
+                if len(alternatives) * len(element_alternatives) > max_alternatives:
+                    raise not_finite()
+                # earlier elements vary slowest, just as in the nested loops of _match(expression_node)
+                alternatives = [first + second for first, second in product(alternatives, element_alternatives)]
+        case _:
+            # repetitions, word borders and anything else the matcher doesn't implement (yet)
+            raise not_finite()
+
+    if len(alternatives) > max_alternatives:
+        raise not_finite()
+    return alternatives
+
+
+def alternative_replacement(alt: alternative, change: change_node) -> str:
+    "What change replaces a match of alt with, which doesn't depend on where in a word it's found."
+    return replace_matches(alt.string, [match_data(0, len(alt.string), alt.string, alt.classes)], change)
+
+
+class _first_match_table:
+    "The alternatives for an expression, indexed by the first character they need."
+
+    def __init__(self, alternatives: list[alternative]):
+        self.alternatives = alternatives
+        # alternatives that consume nothing are possible at any position, so they go in every bucket,
+        # in their original order relative to the rest
+        empties = [alt for alt in alternatives if not alt.string]
+        self.by_first_char: dict[str, list[alternative]] = {}
+        for alt in alternatives:
+            if alt.string:
+                self.by_first_char.setdefault(alt.string[0], [])
+        for char, bucket in self.by_first_char.items():
+            bucket.extend(alt for alt in alternatives if not alt.string or alt.string[0] == char)
+        self.default = empties
+
+    def first_match(self, word: str, pos: int) -> Optional[alternative]:
+        if pos < len(word):
+            candidates = self.by_first_char.get(word[pos], self.default)
+        else:
+            candidates = self.default
+        for alt in candidates:
+            if alt.matches(word, pos):
+                return alt
+        return None
+
+
+@dataclass
+class _compiled_environment:
+    # the pre-environment is compiled reversed, and checked against the reversed word, as environment_works does
+    pre: _first_match_table
+    post: _first_match_table
+    is_positive: bool
+
+    def works(self, word: str, reversed_word: str, start: int, end: int) -> bool:
+        pre_match = self.pre.first_match(reversed_word, len(word) - start)
+        post_match = self.post.first_match(word, end)
+        return (pre_match is not None and post_match is not None) == self.is_positive
+
+
+@dataclass
+class _compiled_change:
+    change: change_node
+    target: _first_match_table
+    # if a word has none of these characters, the target can't match anywhere in it
+    first_chars: frozenset[str] = field(default_factory = frozenset)
+
+    def matches(self, word: str) -> list[tuple[int, alternative]]:
+        "Finds matches exactly as match_change does: leftmost first, without overlapping."
+        found = []
+        first_match = self.target.first_match
+        idx = 0
+        while idx < len(word):
+            alt = first_match(word, idx)
+            if alt is not None:
+                found.append((idx, alt))
+                idx += len(alt.string)
+            else:
+                idx += 1
+        return found
+
+
+@dataclass
+class compiled_rule:
+    rule: rule_node
+    changes: list[_compiled_change]
+    positive_environments: list[_compiled_environment]
+    negative_environments: list[_compiled_environment]
+
+    def environments_work(self, word: str, reversed_word: str, start: int, end: int) -> bool:
+        return all(env.works(word, reversed_word, start, end) for env in self.negative_environments) \
+                and (not self.positive_environments
+                or any(env.works(word, reversed_word, start, end) for env in self.positive_environments))
+
+    def __call__(self, word: str) -> str:
+        new_word = word
+        reversed_word = None
+        for change in self.changes:
+            # as in apply_rule, every change is matched against the word as it was before the rule
+            if change.first_chars.isdisjoint(word):
+                continue
+            if reversed_word is None:
+                reversed_word = word[::-1]
+            matches = []
+            for start, alt in change.matches(word):
+                end = start + len(alt.string)
+                if self.environments_work(word, reversed_word, start, end):
+                    matches.append(match_data(start, end, word, alt.classes))
+            if matches:
+                new_word = replace_matches(new_word, matches, change.change)
+        return new_word
+
+
+def _compile_environment(env: environment_node) -> _compiled_environment:
+    return _compiled_environment(
+        _first_match_table(expand(_reverse_node(env.pre_expression))),
+        _first_match_table(expand(env.post_expression)),
+        env.is_positive)
+
+
+def compile_rule(rule: rule_node) -> Optional[compiled_rule]:
+    """Compiles a rule whose target and environments only ever match a finite (and small) set of strings.
+    Returns None for any other rule, which should be left to the interpreter."""
+    try:
+        changes = []
+        for change in rule.changes:
+            if not change.target or not change.replacement:
+                # malformed; let the interpreter fail on it the way it always has
+                return None
+            alternatives = expand(change.target[0])
+            if any(not alt.string for alt in alternatives):
+                # a target matching nothing never moves match_change along, leave that to the interpreter too
+                return None
+            changes.append(_compiled_change(change, _first_match_table(alternatives),
+                                            frozenset(alt.string[0] for alt in alternatives)))
+
+        return compiled_rule(rule, changes,
+            [_compile_environment(env) for env in rule.positive_environments],
+            [_compile_environment(env) for env in rule.negative_environments])
+
+    except not_finite:
+        return None
+
+
+@dataclass
+class rule_cascade:
+    """A run of consecutive compiled rules, applied as a single pass over each word.
+    first_rule is the index of the cascade's first rule in the full rule list."""
+    first_rule: int
+    rules: list[compiled_rule]
+
+    def __call__(self, word: str) -> str:
+        for rule in self.rules:
+            word = rule(word)
+        return word
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+def compile_rules(rule_list: list[rule_node]) -> list[rule_cascade | rule_node]:
+    """Compiles as many rules as possible, joining consecutive compiled rules into cascades.
+    Rules that can't be compiled are left as they are, in place, to be interpreted."""
+    stages: list[rule_cascade | rule_node] = []
+    for idx, rule in enumerate(rule_list):
+        compiled = compile_rule(rule)
+        if compiled is None:
+            stages.append(rule)
+        elif stages and isinstance(stages[-1], rule_cascade):
+            stages[-1].rules.append(compiled)
+        else:
+            stages.append(rule_cascade(idx, [compiled]))
+    return stages
+
+
+def apply_compiled(stages: list[rule_cascade | rule_node], word_list: list[str], start_rule: int = 0,
+                   on_rule_done: Callable[[int, list[str]], None] = None, metrics: run_metrics = None,
+                   work_limit: int = None) -> list[str]:
+    """Applies compiled stages to a lexicon, with the same results as apply_rules on the original rules.
+    Like apply_rules, can start partway through the rule list and report progress after each rule;
+    with on_rule_done, cascades are run a rule at a time over the whole lexicon so that there is
+    something to report, and otherwise as a single pass over each word.
+    work_limit only applies to the rules left to be interpreted; compiled ones try a bounded number of alternatives."""
+    if metrics:
+        metrics.start_rules()
+    rules_done = 0
+    for stage in stages:
+        stage_size = len(stage) if isinstance(stage, rule_cascade) else 1
+        if rules_done + stage_size <= start_rule:
+            rules_done += stage_size
+            continue
+
+        if isinstance(stage, rule_cascade):
+            # skip any rules of this cascade that were already applied
+            skipped = max(start_rule - rules_done, 0)
+            rules_done += skipped
+            rules = stage.rules[skipped:]
+            # a single pass over each word leaves nothing to report until the end of the cascade
+            runs = [[rule] for rule in rules] if on_rule_done else [rules]
+            steps = [(rule_cascade(stage.first_rule + skipped + idx * len(run), run), len(run)) for idx, run in enumerate(runs)]
+        else:
+            steps = [(lambda word, stage = stage: apply_rule(stage, word, work_limit = work_limit), 1)]
+
+        for run, size in steps:
+            for idx, word in enumerate(word_list):
+                word_list[idx] = run(word)
+            rules_done += size
+            if metrics:
+                metrics.rule_done(rules_done, len(word_list))
+            if on_rule_done:
+                on_rule_done(rules_done, word_list)
+    return word_list
+
+
+def apply_rules_compiled(rule_list: list[rule_node], word_list: list[str]) -> list[str]:
+    return apply_compiled(compile_rules(rule_list), word_list)
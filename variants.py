@@ -0,0 +1,139 @@
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import time
+
+from applier import apply_rules, load_lexicon, write_output
+from parsing import parse_rule_file
+from rule_ast import rule_node
+
+
+@dataclass
+class variant_tree_node:
+    """A node in a prefix tree of rule lists.
+
+    Each node holds a run of rules shared by every variant below it, so chains without
+    any branching are stored in a single node."""
+    rules: list[rule_node] = field(default_factory = list)
+    children: list[variant_tree_node] = field(default_factory = list)
+    # indices of the variants whose rule lists end exactly at this node
+    variants: list[int] = field(default_factory = list)
+
+
+def _insert(root: variant_tree_node, rule_list: list[rule_node], variant: int):
+    node = root
+    pos = 0
+    while pos < len(rule_list):
+        for child in node.children:
+            # rules are compared structurally, so identical rules from different files are shared
+            if child.rules[0] == rule_list[pos]:
+                break
+        else:
+            node.children.append(variant_tree_node(rule_list[pos:], variants = [variant]))
+            return
+
+        # follow the child's run of rules as far as it agrees with this rule list
+        shared = 1
+        while shared < len(child.rules) and pos + shared < len(rule_list) \
+                and child.rules[shared] == rule_list[pos + shared]:
+            shared += 1
+
+        if shared < len(child.rules):
+            # the lists diverge partway through the child, so split it
+            tail = variant_tree_node(child.rules[shared:], child.children, child.variants)
+            child.rules = child.rules[:shared]
+            child.children = [tail]
+            child.variants = []
+
+        node = child
+        pos += shared
+
+    node.variants.append(variant)
+
+
+def build_variant_tree(rule_lists: list[list[rule_node]]) -> variant_tree_node:
+    root = variant_tree_node()
+    for variant, rule_list in enumerate(rule_lists):
+        _insert(root, rule_list, variant)
+    return root
+
+
+def count_rule_applications(root: variant_tree_node) -> int:
+    "Counts how many rules the tree applies in total, i.e. the size of the tree."
+    total = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        total += len(node.rules)
+        stack.extend(node.children)
+    return total
+
+
+def apply_rule_variants(rule_lists: list[list[rule_node]], word_list: list[str]) -> list[list[str]]:
+    """Applies each rule list to the lexicon, returning one changed lexicon per rule list.
+
+    Rules shared by several lists at the start of (a part of) those lists are only applied once,
+    and the lexicon is only copied where the lists branch off from one another."""
+    results: list[list[str]] = [None] * len(rule_lists)
+
+    # an explicit stack rather than recursion, as long rule files make for deep trees
+    stack = [(build_variant_tree(rule_lists), word_list)]
+    while stack:
+        node, words = stack.pop()
+        words = apply_rules(node.rules, words)
+
+        for variant in node.variants:
+            results[variant] = list(words)
+
+        # the last child can take the lexicon over, every other one needs its own copy
+        for idx, child in enumerate(node.children):
+            if idx == len(node.children) - 1:
+                stack.append((child, words))
+            else:
+                stack.append((child, list(words)))
+
+    return results
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Apply several variants of a rule file to one lexicon, "
+        "applying the rules they share only once.")
+
+    parser.add_argument("lex_file", action = "store", type = argparse.FileType("r", encoding = "utf-8"))
+    parser.add_argument("rules_files", action = "store", nargs = "+", type = Path)
+    parser.add_argument("-d", "--out-dir", action = "store", type = Path, default = Path("."), dest = "out_dir",
+        help = "directory to write outputs to; each is named after its rule file")
+    parser.add_argument("--time", action = "store_true")
+
+    args = parser.parse_args()
+
+    out_paths = [args.out_dir/(path.name + ".changed") for path in args.rules_files]
+    if len(set(out_paths)) != len(out_paths):
+        parser.error("rule files must have distinct names, as outputs are named after them")
+
+    if args.time:
+        start_time = time()
+
+    rule_lists = []
+    for path in args.rules_files:
+        with open(path, "r", encoding = "utf-8") as rule_file:
+            rule_lists.append(parse_rule_file(rule_file))
+
+    results = apply_rule_variants(rule_lists, load_lexicon(args.lex_file))
+
+    args.out_dir.mkdir(parents = True, exist_ok = True)
+    for out_path, word_list in zip(out_paths, results):
+        with open(out_path, "w", encoding = "utf-8") as out_file:
+            write_output(word_list, out_file)
+
+    if args.time:
+        run_time = time() - start_time # type: ignore
+        print("Execution time: " + str(run_time))
+        shared = count_rule_applications(build_variant_tree(rule_lists))
+        separate = sum(len(rule_list) for rule_list in rule_lists)
+        print(f"Rule passes over the lexicon: {shared} (vs {separate} run separately)")
@@ -0,0 +1,156 @@
+
+from __future__ import annotations
+
+import os
+import sys
+import traceback
+from io import StringIO
+from time import perf_counter, sleep
+from typing import TextIO
+
+from applier import apply_rules, load_lexicon
+from output_formats import output_formats
+from parsing import _remove_whitespace, parse_rules, parse_sound_classes
+from rule_ast import rule_node
+from sound_class import sound_class
+
+
+# printed after each run's output when writing to stdout
+_separator = "-" * 40
+
+
+def _file_state(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _split_class_section(text: str) -> tuple[str, str]:
+    "Splits a rule file into its class section (up to and including the rules: line) and the rules after it."
+    lines = text.splitlines(keepends = True)
+    for idx, line in enumerate(lines):
+        if _remove_whitespace(line).startswith("rules:"):
+            return "".join(lines[:idx + 1]), "".join(lines[idx + 1:])
+    return text, ""
+
+
+class rule_file_cache:
+    """Parses successive versions of a rule file, only parsing the rules whose text is new.
+    Everything is parsed again if anything in the class section changes."""
+
+    def __init__(self):
+        self.class_text: str = None
+        self.classes: dict[str, sound_class] = None
+        self.offset = 0
+        self.rules: dict[str, rule_node] = {}
+        # how many rules the last parse actually had to parse
+        self.reparsed = 0
+
+    def parse(self, text: str) -> list[rule_node]:
+        class_text, rules_text = _split_class_section(text)
+        if class_text != self.class_text:
+            classes, offset = parse_sound_classes(StringIO(class_text))
+            self.class_text, self.classes, self.offset = class_text, classes, offset
+            self.rules = {}
+
+        cached = len(self.rules)
+        rule_list = parse_rules(StringIO(rules_text), self.offset, self.classes, cache = self.rules)
+        self.reparsed = len(self.rules) - cached
+
+        # forget rules that are no longer in the file
+        in_use = set(map(id, rule_list))
+        self.rules = {line: rule for line, rule in self.rules.items() if id(rule) in in_use}
+        return rule_list
+
+
+class watcher:
+    """Re-runs a rule file over a lexicon whenever either changes.
+
+    The lexicon is kept as it was after every rule, so when a rule file changes only the rules from
+    the first one that's different need to be applied again. A changed lexicon starts over from the first rule."""
+
+    def __init__(self, lex_path: str, rules_path: str, out_file: TextIO = None, out_format: str = "plain",
+                 log: TextIO = sys.stderr):
+        self.lex_path = lex_path
+        self.rules_path = rules_path
+        self.out_file = out_file or sys.stdout
+        self.out_format = out_format
+        self.log = log
+
+        self.cache = rule_file_cache()
+        self.lex_state = None
+        self.rules_state = None
+        self.rule_list: list[rule_node] = []
+        # states[i] is the lexicon after the first i rules
+        self.states: list[list[str]] = []
+
+    def refresh(self) -> bool:
+        "Re-runs whatever is needed if either file has changed since the last refresh, returning whether anything was."
+        lex_state, rules_state = _file_state(self.lex_path), _file_state(self.rules_path)
+        if lex_state == self.lex_state and rules_state == self.rules_state:
+            return False
+
+        start = perf_counter()
+        if lex_state != self.lex_state:
+            with open(self.lex_path, "r", encoding = "utf-8") as lex_file:
+                self.states = [load_lexicon(lex_file)]
+            self.lex_state = lex_state
+        loaded = perf_counter()
+
+        if rules_state != self.rules_state:
+            with open(self.rules_path, "r", encoding = "utf-8") as rules_file:
+                rule_list = self.cache.parse(rules_file.read())
+            self.rules_state = rules_state
+        else:
+            rule_list = self.rule_list
+        parsed = perf_counter()
+
+        # unchanged lines give back the very same rule objects, or equal ones if they've moved
+        first_changed = 0
+        for old, new in zip(self.rule_list, rule_list):
+            if old is not new and old != new:
+                break
+            first_changed += 1
+        first_changed = min(first_changed, len(self.states) - 1)
+
+        # set before applying, so the states kept always line up with it, even if a rule fails partway
+        self.rule_list = rule_list
+        del self.states[first_changed + 1:]
+        for rule in rule_list[first_changed:]:
+            self.states.append(apply_rules([rule], list(self.states[-1])))
+        applied = perf_counter()
+
+        self.write()
+        if first_changed < len(rule_list):
+            applied_str = f"applied rules {first_changed + 1}-{len(rule_list)} in {(applied - parsed) * 1000:.1f}ms"
+        else:
+            applied_str = "no rules to apply again"
+        self.log.write(f"loaded in {(loaded - start) * 1000:.1f}ms, "
+                       f"parsed {self.cache.reparsed}/{len(rule_list)} rules in {(parsed - loaded) * 1000:.1f}ms, "
+                       f"{applied_str}\n")
+        self.log.flush()
+        return True
+
+    def write(self):
+        if self.out_file is not sys.stdout:
+            self.out_file.seek(0)
+            self.out_file.truncate(0)
+        output_formats[self.out_format](self.out_file, self.states[-1], self.states[0], 0)
+        if self.out_file is sys.stdout and self.out_format != "binary":
+            # every run's output follows the last one's, so it has to end where the next starts
+            self.out_file.write("\n" + _separator + "\n")
+        self.out_file.flush()
+
+    def run(self, interval: float = 0.2):
+        "Polls both files every interval seconds until interrupted, reporting errors (e.g. in a half-written rule) as it goes."
+        try:
+            while True:
+                try:
+                    self.refresh()
+                except Exception:
+                    traceback.print_exc(file = self.log)
+                    # don't report the same error again until something changes
+                    self.lex_state = _file_state(self.lex_path)
+                    self.rules_state = _file_state(self.rules_path)
+                sleep(interval)
+        except KeyboardInterrupt:
+            pass